@@ -16,14 +16,24 @@
 # %autoreload 2
 
 # +
-import requests
 import socket
 import json
+import os
+import time
+import datetime
 
 try:
     from . import constants
+    from .search_index import SearchIndex
+    from .transport import get_transport
+    from .jsonstream import iter_loop_items
+    from .mirror import MIRROR_STATUS_TAGS, MIRROR_PLAYER_KEYS
 except ImportError as e:
     import constants
+    from search_index import SearchIndex
+    from transport import get_transport
+    from jsonstream import iter_loop_items
+    from mirror import MIRROR_STATUS_TAGS, MIRROR_PLAYER_KEYS
 
 import logging
 # -
@@ -86,6 +96,93 @@ NOW_PLAYING_QUERY = {
     'playlist repeat': [],
     'mixer volume': []}
 
+# now playing keys that differ between synchronized players, with the matching
+# serverstatus players_loop key (None: only known from the mirror)
+SYNC_PLAYER_KEYS = {
+    'player_name': 'name',
+    'player_ip': 'ip',
+    'player_connected': 'connected',
+    'power': 'power',
+    'mixer volume': None,
+    'signalstrength': None}
+
+# commands LMS applies to every member of a sync group
+SYNC_GROUP_COMMANDS = {'play', 'pause', 'stop', 'mode', 'time', 'playlist', 'playlistcontrol', 'favorites'}
+
+# LMS tags that add a field to songinfo, titles and status playlist_loop results
+SONGINFO_TAGS = {
+    'artist': 'a',
+    'coverid': 'c',
+    'compilation': 'C',
+    'duration': 'd',
+    'addedTime': 'D',
+    'album_id': 'e',
+    'filesize': 'f',
+    'genre': 'g',
+    'channels': 'H',
+    'disc': 'i',
+    'coverart': 'j',
+    'artwork_track_id': 'J',
+    'comment': 'k',
+    'artwork_url': 'K',
+    'album': 'l',
+    'bpm': 'm',
+    'modificationTime': 'n',
+    'remote_title': 'N',
+    'type': 'o',
+    'genre_id': 'p',
+    'disccount': 'q',
+    'bitrate': 'r',
+    'artist_id': 's',
+    'tracknum': 't',
+    'samplerate': 'T',
+    'lastUpdated': 'U',
+    'tagversion': 'v',
+    'remote': 'x',
+    'year': 'y'}
+
+# tag sent when none of the requested fields has one: an empty "tags:" makes LMS
+# fall back to its default tag set, so ask for a single small field instead (remote)
+SONGINFO_MINIMAL_TAG = 'x'
+
+# LMS tags that add a field to albums results
+ALBUM_TAGS = {
+    'artist': 'a',
+    'disc': 'i',
+    'artwork_track_id': 'j',
+    'album': 'l',
+    'disccount': 'q',
+    'artist_id': 'S',
+    'compilation': 'w',
+    'year': 'y'}
+
+# disccount; see SONGINFO_MINIMAL_TAG
+ALBUM_MINIMAL_TAG = 'q'
+
+
+def fields_to_tags(fields, tag_map=SONGINFO_TAGS, minimal_tag=SONGINFO_MINIMAL_TAG):
+    '''smallest LMS "tags:" parameter that returns the requested fields
+    
+    Fields without a tag (e.g. id, title or status keys) add nothing; if no
+    field has a tag, minimal_tag is requested
+    
+    Args:
+        fields(list): result keys e.g. ['artist', 'album', 'artwork_url']
+        tag_map(dict): SONGINFO_TAGS or ALBUM_TAGS
+        minimal_tag(str): SONGINFO_MINIMAL_TAG or ALBUM_MINIMAL_TAG
+    
+    Returns:
+        (str): e.g. "tags:al"'''
+    tags = sorted({tag_map[f] for f in fields if f in tag_map})
+    return 'tags:' + (''.join(tags) or minimal_tag)
+
+
+def _project(item, fields):
+    '''copy of item containing only fields'''
+    if fields is None:
+        return item
+    return {k: item[k] for k in fields if k in item}
+
 
 # + code_folding=[57, 62, 66, 71, 75, 94, 106, 115, 167, 246, 253, 256, 260, 266, 273, 280, 287, 302, 313, 348, 361, 364, 383, 387, 543]
 class QueryLMS():
@@ -114,6 +211,10 @@ class QueryLMS():
         server_base_url(str): base url of server: http://host:port/
         handle_requests_exceptions(bool): True: quietly handle exceptions; False: raise exceptions
         request_timeout(int): seconds to wait for server to respond
+        search_index(SearchIndex): local library index used by search_* methods when built
+        transport: sends queries to the server; see the QueryLMS.transport module
+        mirror(PlayerStateMirror): if set, player getters read from the mirror instead of the server
+        track_cache(TrackCache): if set, caches songinfo and artwork; see the QueryLMS.prefetch module
         
     
     Additional API documentation: https://github.com/elParaguayo/LMS-CLI-Documentation/blob/master/LMS-CLI.md
@@ -123,7 +224,8 @@ class QueryLMS():
                  player_id=None, 
                  scan_timeout=1,
                  handle_requests_exceptions=False,
-                 request_timeout=5
+                 request_timeout=5,
+                 transport=None
                 ):
         '''inits QueryLMS Class with host, port, player_id, player_name and scan_timeout
         
@@ -133,13 +235,22 @@ class QueryLMS():
             player_name(str): name of player to associate with
             player_id(str): player_id in hex 
             scan_timeout(int): seconds to search for LMS host
+            transport: transport object such as RecordingTransport or ReplayTransport, or
+                the name "requests" or "http.client"; default requests when installed
         '''
         self.handle_requests_exceptions=handle_requests_exceptions
+        if transport is None or isinstance(transport, str):
+            transport = get_transport(transport)
+        self.transport = transport
 
         self.host = host
         self.port = port
         self.request_timeout = request_timeout
         self.scan_timeout = scan_timeout
+        self.search_index = None
+        self.mirror = None
+        self.track_cache = None
+        self._sync_groups = None
         self.set_server()
         self.player_id = player_id
         self.player_name = player_name
@@ -207,7 +318,8 @@ class QueryLMS():
     def set_server(self):
         '''set the server details using "host" and "port"
         
-        If no host and port is specified, queryLMS will search for the 
+        If no host and port is specified, queryLMS will use the proxy set in
+        the QUERYLMS_PROXY environment variable (host:port) or search for the 
         first LMS server on the local network segment.
         
         If the server IP/name or port change it is necessary
@@ -231,6 +343,18 @@ class QueryLMS():
         if self.host and self.port:
             my_host = self.host
             my_port = self.port
+        elif os.environ.get(constants.LMS_PROXY_ENV):
+            proxy = os.environ[constants.LMS_PROXY_ENV].strip()
+            my_host, _, my_port = proxy.partition(':')
+            my_host = my_host or constants.LMS_PROXY_HOST
+            try:
+                my_port = int(my_port) if my_port else constants.LMS_PROXY_PORT
+            except ValueError:
+                logging.warning(f'invalid port in {constants.LMS_PROXY_ENV}={proxy}; using {constants.LMS_PROXY_PORT}')
+                my_port = constants.LMS_PROXY_PORT
+            logging.info(f'using LMS proxy at {my_host}:{my_port}')
+            self.host = my_host
+            self.port = my_port
         else:
             my_host = None
             my_port = None
@@ -313,28 +437,108 @@ class QueryLMS():
     # Basic Query
     #####################################
     def query(self, player_id=None, *args):
-        if not self.player_id:
-            player_id = self.player_id
+        '''send a command to the server
+        
+        Args:
+            player_id(str): player to query; "" for server queries; None: the associated player
+            *args: LMS command
             
-        r = {}
+        Returns:
+            (dict): result of the command'''
+        if player_id is None:
+            player_id = self.player_id
+
+        r = ''
         retval = {}
-        params = json.dumps({'id': 1, 'method': 'slim.request',
-                             'params': [player_id, list(args)]})
+        params = {'id': 1, 'method': 'slim.request',
+                  'params': [player_id, list(args)]}
         if self.server_query_url:
             try:
-                r = requests.post(timeout=self.request_timeout, url=self.server_query_url, data=params)
-            except requests.exceptions.RequestException as e:
+                r = self.transport.post(self.server_query_url, params, self.request_timeout)
+            except self.transport.errors as e:
                 if self.handle_requests_exceptions:
                     logging.warning(f'error making connection to server: {e}')
                 else:
                     raise e
             if r:
-                retval = json.loads(r.text)['result']
+                retval = json.loads(r)['result']
         else:
             logging.warning('"server_query_url" is not set')
 
         return retval
 
+    def query_stream(self, player_id=None, *args, fields=None):
+        '''like query(), but yield "*_loop" items while the response downloads
+        
+        Only the item being decoded is held in memory, so callers can start
+        using results before a large response has arrived.
+        
+        Args:
+            player_id(str): player to query; "" for server queries; None: the associated player
+            *args: LMS command
+            fields(dict): if given, filled with the other result values such as "count"
+            
+        Yields:
+            (tuple): ("<name>_loop", item)'''
+        if player_id is None:
+            player_id = self.player_id
+        params = {'id': 1, 'method': 'slim.request',
+                  'params': [player_id, list(args)]}
+        if not self.server_query_url:
+            logging.warning('"server_query_url" is not set')
+            return
+        chunks = self.transport.stream(self.server_query_url, params, self.request_timeout,
+                                       constants.LMS_STREAM_CHUNK_SIZE)
+        try:
+            yield from iter_loop_items(chunks, fields)
+        except self.transport.errors as e:
+            if self.handle_requests_exceptions:
+                logging.warning(f'error making connection to server: {e}')
+            else:
+                raise e
+
+    def _iter_loop(self, loop, player_id, *args):
+        for key, item in self.query_stream(player_id, *args):
+            if key == loop:
+                yield item
+
+    def _mirrored(self, key, track_key=None):
+        '''read the associated player's state from the mirror
+        
+        Args:
+            key(str): status key
+            track_key(str): key of the current track; key is then ignored
+        
+        Returns:
+            (tuple): (True, value) or (False, None) if there is no mirrored value'''
+        if not (self.mirror and self.mirror.has(self.player_id)):
+            return False, None
+        if track_key:
+            track = self.mirror.get(self.player_id, 'track', {})
+            return track_key in track, track.get(track_key)
+        state = self.mirror.get(self.player_id)
+        return key in state, state.get(key)
+
+    def _mirrored_status(self, player_id, tags=None):
+        '''status of player_id rebuilt from the mirror, as returned by "status - 1 tags:"
+        
+        Args:
+            player_id(str): player id
+            tags(str): "tags:..." the playlist entry must provide
+        
+        Returns:
+            (dict): status with playlist_loop, or None if the mirror cannot answer'''
+        if not (self.mirror and self.mirror.has(player_id)):
+            return None
+        if tags and not set(tags[len('tags:'):]) <= set(MIRROR_STATUS_TAGS[len('tags:'):]):
+            return None
+        state = self.mirror.get(player_id)
+        track = state.pop('track', None)
+        status = {k: v for k, v in state.items()
+                  if k != 'updated' and (k not in MIRROR_PLAYER_KEYS or k == 'power')}
+        status['playlist_loop'] = [track] if track else []
+        return status
+
     # Server commands
     #####################################
     def rescan(self):
@@ -357,6 +561,47 @@ class QueryLMS():
             (dict): JSON formatted list of ids and artists'''
         return self.query("", "artists", 0, 9999)['artists_loop']
 
+    def _iter_projected(self, loop, fields, command, count, tag_map, minimal_tag):
+        args = ['', command, 0, count]
+        if fields is not None and tag_map:
+            args.append(fields_to_tags(fields, tag_map, minimal_tag))
+        for item in self._iter_loop(loop, *args):
+            yield _project(item, fields)
+
+    def iter_artists(self, count=9999):
+        '''yield artists as they are received from the server
+        
+        Args:
+            count(int): maximum number of artists
+            
+        Yields:
+            (dict): {"id": int, "artist": str}'''
+        return self._iter_loop('artists_loop', '', 'artists', 0, count)
+
+    def iter_albums(self, count=9999, fields=None):
+        '''yield albums as they are received from the server
+        
+        Args:
+            count(int): maximum number of albums
+            fields(list): only request and return these keys e.g. ['id', 'album', 'year']
+            
+        Yields:
+            (dict): {"id": int, "album": str}'''
+        return self._iter_projected('albums_loop', fields, 'albums', count, ALBUM_TAGS,
+                                   ALBUM_MINIMAL_TAG)
+
+    def iter_tracks(self, count=9999, fields=None):
+        '''yield tracks as they are received from the server
+        
+        Args:
+            count(int): maximum number of tracks
+            fields(list): only request and return these keys e.g. ['id', 'title', 'artist']
+            
+        Yields:
+            (dict): {"id": int, "title": str}'''
+        return self._iter_projected('titles_loop', fields, 'titles', count, SONGINFO_TAGS,
+                                   SONGINFO_MINIMAL_TAG)
+
     def get_artist_count(self):
         '''query server for total number of artists
         
@@ -394,6 +639,13 @@ class QueryLMS():
             
         return players.get('players_loop', [])
     
+    def iter_players(self):
+        '''yield connected player information as it is received from the server
+        
+        Yields:
+            (dict): player information'''
+        return self._iter_loop('players_loop', '', 'serverstatus', 0, 99)
+
     def search(self, searchstring, count=9999):
         '''query server for searchstring (ignoring case)
         
@@ -405,53 +657,84 @@ class QueryLMS():
             '''
         return self.query('', "search", 0, count, "term:" + searchstring)
 
-    def search_tracks(self, searchstring, count=9999):
-        '''query server for searchstring in track names (ignoring case)
+    def iter_search(self, searchstring, count=9999):
+        '''yield search results for searchstring as they are received from the server
         
         Args:
-            searchstring(str): string to search tracks for
+            searchstring(str): string to search for
+            count(int): maximum number of results per category
+        
+        Yields:
+            (tuple): ("tracks_loop", "albums_loop" or "contributors_loop", item)'''
+        return self.query_stream('', "search", 0, count, "term:" + searchstring)
+
+    def build_search_index(self, page_size=500, categories=None):
+        '''pull the library and build a local index for search_* methods
+        
+        Once built, search_tracks, search_albums and search_contributors are
+        answered locally. Run search_index.refresh() after a library rescan.
+        
+        Args:
+            page_size(int): items to request per query when pulling the library
+            categories(list): any of "tracks", "albums", "contributors"; default all
             
         Returns:
-            (dict): JSON formatted list of all track entities containing searchstring'''
+            (SearchIndex)'''
+        self.search_index = SearchIndex(self, page_size=page_size, categories=categories).build()
+        return self.search_index
+
+    def _search_loop(self, category, searchstring, count, mode, local):
+        '''search a single category using the local index if available'''
+        index = self.search_index
+        if local and index and index.ready and category in index.categories:
+            return index.search(category, searchstring, count, mode)
+
         result = self.search(searchstring, count)
-        if 'tracks_loop' in result:
-            response = {"tracks_count": result['tracks_count'],
-                    "tracks_loop": result['tracks_loop']}
+        if f'{category}_loop' in result:
+            response = {f"{category}_count": result[f'{category}_count'],
+                    f"{category}_loop": result[f'{category}_loop']}
         else:
-            response = {"tracks_count": 0}
+            response = {f"{category}_count": 0}
         return response
 
-    def search_albums(self, searchstring, count=9999):
+    def search_tracks(self, searchstring, count=9999, mode='substring', local=True):
+        '''query server for searchstring in track names (ignoring case)
+        
+        Args:
+            searchstring(str): string to search tracks for
+            count(int): maximum number of results
+            mode(str): "substring", "prefix" or "fuzzy" (local index only)
+            local(bool): use the local search index if it has been built
+            
+        Returns:
+            (dict): JSON formatted list of all track entities containing searchstring'''
+        return self._search_loop('tracks', searchstring, count, mode, local)
+
+    def search_albums(self, searchstring, count=9999, mode='substring', local=True):
         '''query server for searchstring in album names (ignoring case)
         
         Args:
             searchstring(str): string to search tracks for
+            count(int): maximum number of results
+            mode(str): "substring", "prefix" or "fuzzy" (local index only)
+            local(bool): use the local search index if it has been built
             
         Returns:
             (dict): JSON formatted list of all album entities containing searchstring'''        
-        result = self.search(searchstring, count)
-        if 'albums_loop' in result:
-            response = {"albums_count": result['albums_count'],
-                    "albums_loop": result['albums_loop']}
-        else:
-            response = {"albums_count": 0}
-        return response
+        return self._search_loop('albums', searchstring, count, mode, local)
 
-    def search_contributors(self, searchstring, count=9999):
+    def search_contributors(self, searchstring, count=9999, mode='substring', local=True):
         '''query server for searchstring in contributors names (ignoring case)
         
         Args:
             searchstring(str): string to search tracks for
+            count(int): maximum number of results
+            mode(str): "substring", "prefix" or "fuzzy" (local index only)
+            local(bool): use the local search index if it has been built
             
         Returns:
             (dict): JSON formatted list of all contributors entities containing searchstring'''        
-        result = self.search(searchstring, count)
-        if 'contributors_loop' in result:
-            response = {"contributors_count": result['contributors_count'],
-                    "contributors_loop": result['contributors_loop']}
-        else:
-            response = {"contributors_count": 0}
-        return response
+        return self._search_loop('contributors', searchstring, count, mode, local)
 
     def search_players(self, searchstring, count=9999):
         '''query server for searchstring in player names (ignoring case)
@@ -546,6 +829,9 @@ class QueryLMS():
         
         Returns:
             (str)'''
+        mirrored, volume = self._mirrored('mixer volume')
+        if mirrored:
+            return volume
         volume = self.query(self.player_id, "mixer", "volume", "?")
         if len(volume):
             volume = volume['_volume']
@@ -569,6 +855,11 @@ class QueryLMS():
         
         Returns:
             (str)'''
+        mirrored, title = self._mirrored('current_title')
+        if not mirrored:
+            mirrored, title = self._mirrored(None, 'title')
+        if mirrored:
+            return title
         title = self.query(self.player_id, "current_title", "?")
         
         return title.get('_current_title', '')
@@ -578,6 +869,9 @@ class QueryLMS():
         
         Returns:
             (str)'''
+        mirrored, artist = self._mirrored(None, 'artist')
+        if mirrored:
+            return artist
         artist = self.query(self.player_id, "artist", "?")
         return artist.get('_artist', '')    
 
@@ -586,7 +880,9 @@ class QueryLMS():
         
         Returns:
             (str)'''
-        
+        mirrored, album = self._mirrored(None, 'album')
+        if mirrored:
+            return album
         album = self.query(self.player_id, "album", "?")
         return album.get('_album', '')
 
@@ -595,7 +891,9 @@ class QueryLMS():
         
         Returns:
             (str)'''
-        
+        mirrored, title = self._mirrored(None, 'title')
+        if mirrored:
+            return title
         title = self.query(self.player_id, "title", "?")
         return title.get('_title', '')
     
@@ -612,6 +910,9 @@ class QueryLMS():
     
     @property
     def is_playing_remote_stream(self):
+        if self.mirror and self.mirror.has(self.player_id):
+            # status only reports "remote" while a remote stream is playing
+            return self.mirror.get(self.player_id, 'remote', False)
         remote = self.query(self.player_id, "remote", "?")        
         return remote.get('_remote', False)
 
@@ -623,25 +924,80 @@ class QueryLMS():
         album_artist = self.query(self.player_id, 'albums', 0, 99, 'tags:al', f'artist_id:{artist_id}')
         return album_artist.get('albums_loop', '')
 
-    def get_alarms(self, enabled=True):
-        '''???'''
+    def get_song_info(self, track_id):
+        '''query server for song information of a track
+        
+        Library tracks are answered from track_cache when it is set
+        
+        Args:
+            track_id(int): internal track id
+        
+        Returns:
+            (list): songinfo_loop list of single key dictionaries'''
+        if self.track_cache:
+            info = self.track_cache.get_songinfo(track_id)
+            if info is not None:
+                return info
+
+        track_info = self.query(self.player_id, 'songinfo', '-', 100, f'track_id:{track_id}')
+        info = track_info.get('songinfo_loop', [])
+        if self.track_cache and info:
+            self.track_cache.put_songinfo(track_id, info)
+        return info
+
+    def get_artwork(self, coverid):
+        '''fetch cover art image from server
+        
+        Answered from track_cache when it is set
+        
+        Args:
+            coverid(str): coverid of a track
+        
+        Returns:
+            (bytes): image data'''
+        if self.track_cache:
+            artwork = self.track_cache.get_artwork(coverid)
+            if artwork is not None:
+                return artwork
+
+        artwork = self.transport.get(f'{self.server_base_url}music/{coverid}/cover.jpg',
+                                     self.request_timeout)
+        if self.track_cache:
+            self.track_cache.put_artwork(coverid, artwork)
+        return artwork
+
+    def get_alarms(self, enabled=True, player_id=None):
+        '''query player for alarms
+        
+        Args:
+            enabled(bool): True: only enabled alarms; {} if alarms are disabled for the player
+            player_id(str): player to query; default the associated player
+        
+        Returns:
+            (dict): {"count": int, "alarms_loop": list}'''
+        player_id = player_id or self.player_id
         if enabled:
-            alarmsEnabled = self.get_player_pref("alarmsEnabled")
+            alarmsEnabled = self.get_player_pref("alarmsEnabled", player_id)
             if alarmsEnabled == "0":
                 return {}
             alarm_filter = "enabled"
         else:
             alarm_filter = "all"
-        return self.query(self.player_id, "alarms", 0, 99,
+        return self.query(player_id, "alarms", 0, 99,
             "filter:%s" % alarm_filter)
 
     def get_next_alarm(self):
-        '''???'''
+        '''query associated player for the next enabled alarm today
+        
+        Use AlarmSchedule for the next alarm of every player on any day
+        
+        Returns:
+            (dict): {"alarmtime": seconds after midnight, "delta": seconds from now} or {}'''
         self._check_attribute(attribute='player_id', 
                               check_value=True, 
                               invalid_values=[None, ''])
         
-        alarms = self.get_alarms(self.player_id)
+        alarms = self.get_alarms()
         alarmtime = 0
         delta = 0
         if alarms == {} or alarms['count'] == 0:
@@ -656,6 +1012,9 @@ class QueryLMS():
                                              minutes=now.minute,
                                              seconds=now.second)
             delta_new = alarmtime_new - currenttime
+            if delta_new.total_seconds() < 0:
+                # already sounded today
+                continue
             if delta == 0:
                 delta = delta_new
                 alarmtime = alarmtime_new
@@ -720,7 +1079,7 @@ class QueryLMS():
 
 #         return now_playing_info
     
-    def get_now_playing(self):
+    def get_now_playing(self, fields=None, player_id=None, artwork=False):
         '''query associated player for now playing information including:
         * album
         * artist
@@ -731,16 +1090,40 @@ class QueryLMS():
         * id
         * title
         
+        With fields set, only those keys are returned and the track fields
+        are requested as status tags, skipping the songinfo query
+        
+        The status is read from the mirror when one is set. Library tracks whose
+        songinfo is in track_cache (see Prefetcher) skip the per-key fallback
+        queries, so with both no request is sent.
+        
+        Args:
+            fields(list): keys to return e.g. ['title', 'artist', 'artwork_url', 'mode', 'time']
+            player_id(str): player to query; default the associated player
+            artwork(bool): add the cover image bytes as "artwork", from track_cache if prefetched
+        
         Returns:
             dict'''
 
+        player_id = player_id or self.player_id
         now_playing = {}
-        
-        try:
-            status = self.query(self.player_id, 'status', '-')
-        except Exception as e:
-            logging.warning(f'Failed to query player status and get now playing info with error: {e}')
-            return now_playing
+        tags = None
+        if fields is not None:
+            fields = list(fields)
+            # artwork_url is built from the coverid rather than requested with the K tag
+            tag_fields = [f for f in fields if f != 'artwork_url']
+            tags = fields_to_tags(tag_fields + (['coverid'] if 'artwork_url' in fields else []))
+        
+        status = self._mirrored_status(player_id, tags)
+        if status is None:
+            try:
+                if fields is None:
+                    status = self.query(player_id, 'status', '-')
+                else:
+                    status = self.query(player_id, 'status', '-', 1, tags)
+            except Exception as e:
+                logging.warning(f'Failed to query player status and get now playing info with error: {e}')
+                return now_playing
 
         playlist = status.get('playlist_loop', [])
         
@@ -750,11 +1133,15 @@ class QueryLMS():
             logging.warning('no valid playlist was returned')
             playing_track = {}
         
-        track_id = playing_track.get('id', 0)
-    
-        track_info = self.query(self.player_id, 'songinfo', '-', 100, f'track_id:{track_id}')
-        
-        info_list = track_info.get('songinfo_loop', [])
+        cached = False
+        if fields is None:
+            track_id = playing_track.get('id', 0)
+            cached = bool(self.track_cache and self.track_cache.cacheable(track_id) and
+                          self.track_cache.get_songinfo(track_id) is not None)
+            info_list = self.get_song_info(track_id)
+        else:
+            # the tagged playlist entry already holds the requested track fields
+            info_list = [playing_track]
         
         
         for i in info_list:
@@ -771,14 +1158,19 @@ class QueryLMS():
         now_playing['artwork_url'] = artwork_url
         now_playing = {**now_playing, **status}
         
-        # first run - try to populate missing keys
-        now_playing = self._add_keys(now_playing)
+        if cached:
+            # a prefetched library track is complete: nothing to look up remotely
+            now_playing.setdefault('current_title', now_playing.get('title', ''))
+        else:
+            # first run - try to populate missing keys
+            now_playing = self._add_keys(now_playing, keys=fields, player_id=player_id)
         # fill in null values for remaining keys
-        now_playing = self._add_keys(now_playing, True)
+        now_playing = self._add_keys(now_playing, True, keys=fields, player_id=player_id)
 
 
         try:
-            remote_status = int(now_playing.get('remote', 0))
+            # blank when the player did not report it
+            remote_status = int(now_playing.get('remote') or 0)
         except Exception as e:
             logging.warning(f'unexpected data found in now_playing["remote"]: {e}')
             remote_status = 0
@@ -791,10 +1183,20 @@ class QueryLMS():
         if not now_playing.get('album_id', False):
             now_playing['album_id'] = 'no_album_id'
         
+        if fields is not None:
+            now_playing = {k: now_playing.get(k, '') for k in fields}
+        
+        if artwork:
+            try:
+                now_playing['artwork'] = self.get_artwork(coverid) if coverid else b''
+            except self.transport.errors as e:
+                logging.warning(f'failed to fetch artwork {coverid}: {e}')
+                now_playing['artwork'] = b''
+        
         return now_playing
     
     
-    def _add_keys(self, now_playing, add_blank=False):
+    def _add_keys(self, now_playing, add_blank=False, keys=None, player_id=None):
         '''fill in missing keys using the NOW_PLAYING_QUERY constant
         
         Run with add_blank=False to use queries stored in NOW_PLAYING to attempt to fill
@@ -805,9 +1207,14 @@ class QueryLMS():
         Args:
             now_playin(dict): dictionary of now playing values
             add_blank(bool): True fill in any missing values with a '' string
+            keys(list): only fill in these keys; default all NOW_PLAYING_QUERY keys
+            player_id(str): player to query; default the associated player
         
         '''
+        player_id = player_id or self.player_id
         for k, query in NOW_PLAYING_QUERY.items():
+            if keys is not None and k not in keys:
+                continue
             result = {}
             if not now_playing.get(k, False):
                 if add_blank:
@@ -818,7 +1225,7 @@ class QueryLMS():
 
 
                 if query:
-                    result = self.query(self.player_id, *query)
+                    result = self.query(player_id, *query)
                 for i, j in result.items():
                     if i.strip('_') in NOW_PLAYING_QUERY.keys():
                         logging.debug(f'adding "{k}: {j}" to now_playing')
@@ -827,9 +1234,141 @@ class QueryLMS():
         return now_playing              
             
 
-    def get_player_pref(self, pref):
-        '''???'''      
-        return self.query(self.player_id, "playerpref", pref, "?")['_p2']
+    def get_sync_groups(self, max_age=constants.LMS_SYNC_GROUP_TTL):
+        '''query server for groups of synchronized players
+        
+        The first player of each group is treated as the group master: reads
+        and playback commands for the group are sent to it. Groups are read
+        from the mirror when one is set, otherwise with a single "syncgroups"
+        query that is reused for max_age seconds.
+        
+        Args:
+            max_age(float): seconds to reuse the previous result
+        
+        Returns:
+            (list): lists of player ids, one per sync group'''
+        if self.mirror:
+            groups = {}
+            for pid in self.mirror.players:
+                master = self.mirror.get(pid, 'sync_master')
+                if master:
+                    slaves = self.mirror.get(pid, 'sync_slaves', '')
+                    groups[master] = [master] + [s for s in slaves.split(',') if s and s != master]
+            return list(groups.values())
+
+        if self._sync_groups and self._sync_groups[0] > time.monotonic():
+            return self._sync_groups[1]
+        result = self.query('', 'syncgroups', '?')
+        groups = [g.get('sync_members', '').split(',') for g in result.get('syncgroups_loop', [])]
+        groups = [g for g in groups if g and g[0]]
+        self._sync_groups = (time.monotonic() + max_age, groups)
+        return groups
+
+    def sync_group(self, player_id=None):
+        '''players synchronized with player_id, master first
+        
+        Args:
+            player_id(str): player id; default the associated player
+        
+        Returns:
+            (list): player ids; [player_id] if the player is not synchronized'''
+        player_id = player_id or self.player_id
+        for group in self.get_sync_groups():
+            if player_id in group:
+                return group
+        return [player_id]
+
+    def _group_masters(self, player_ids):
+        '''map each of player_ids to the master of its sync group'''
+        groups = self.get_sync_groups()
+        masters = {}
+        for pid in player_ids:
+            masters[pid] = next((g[0] for g in groups if pid in g), pid)
+        return masters
+
+    def _player_keys(self, player_id, players, fields=None):
+        '''SYNC_PLAYER_KEYS of player_id from the mirror or serverstatus entries
+        
+        Args:
+            player_id(str): player id
+            players(dict): {player_id: serverstatus players_loop entry}
+            fields(list): only these keys
+        
+        Returns:
+            (dict): keys the source does not provide are '''''
+        keys = [k for k in SYNC_PLAYER_KEYS if fields is None or k in fields]
+        if self.mirror and self.mirror.has(player_id):
+            state = self.mirror.get(player_id)
+            return {k: state.get(k, '') for k in keys}
+        player = players.get(player_id, {})
+        return {k: player.get(SYNC_PLAYER_KEYS[k], '') if SYNC_PLAYER_KEYS[k] else '' for k in keys}
+
+    def get_now_playing_group(self, player_ids=None, fields=None):
+        '''now playing information for several players, queried once per sync group
+        
+        Synchronized players share the track and playback keys of their group
+        master. The player specific keys in SYNC_PLAYER_KEYS ("player_name",
+        "mixer volume", "power" ...) are each member's own, read from the mirror
+        or from serverstatus; without a mirror "mixer volume" and
+        "signalstrength" of synchronized members are ''.
+        
+        Args:
+            player_ids(list): players to query; default all connected players
+            fields(list): keys to return; see get_now_playing()
+        
+        Returns:
+            (dict): {player_id: now playing dict}'''
+        players = None
+        if player_ids is None:
+            players = {p.get('playerid'): p for p in self.get_players()}
+            player_ids = list(players)
+        masters = self._group_masters(player_ids)
+        results = {}
+        for master in set(masters.values()):
+            results[master] = self.get_now_playing(fields=fields, player_id=master)
+        
+        group = {}
+        for pid, master in masters.items():
+            now_playing = dict(results[master])
+            if pid != master and now_playing:
+                if players is None and not (self.mirror and self.mirror.has(pid)):
+                    players = {p.get('playerid'): p for p in self.get_players()}
+                now_playing.update(self._player_keys(pid, players or {}, fields))
+            group[pid] = now_playing
+        return group
+
+    def query_group(self, *args, player_ids=None):
+        '''send a command to player_ids, once per sync group where LMS allows it
+        
+        LMS applies the playback commands in SYNC_GROUP_COMMANDS (play, pause,
+        playlist ...) to every member of a sync group, so these are only sent to
+        the master of each group. Other commands such as "mixer volume" or
+        "power" are sent to each player.
+        
+        Args:
+            *args: LMS command e.g. "pause", 1
+            player_ids(list): players to command; default all connected players
+        
+        Returns:
+            (dict): {player_id: query result} for each player the command was sent to'''
+        if player_ids is None:
+            player_ids = [p.get('playerid') for p in self.get_players()]
+        if args and str(args[0]) in SYNC_GROUP_COMMANDS:
+            targets = set(self._group_masters(player_ids).values())
+        else:
+            targets = player_ids
+        return {pid: self.query(pid, *args) for pid in targets}
+
+    def get_player_pref(self, pref, player_id=None):
+        '''query player for the value of a player preference
+        
+        Args:
+            pref(str): preference name e.g. "alarmsEnabled"
+            player_id(str): player to query; default the associated player
+        
+        Returns:
+            (str)'''      
+        return self.query(player_id or self.player_id, "playerpref", pref, "?")['_p2']
 
     def set_player_pref(self, pref, value):
         '''???'''
@@ -0,0 +1,199 @@
+'''Upcoming alarms for every player on an LMS
+
+An AlarmSchedule fetches the alarm lists of all players concurrently and
+builds a sorted timeline of upcoming alarms. The timeline is rebuilt only when
+the fetched alarm data changes (or a day has passed), so "next alarm anywhere"
+and per-player lookups are answered from memory.
+
+    schedule = AlarmSchedule(my_lms)
+    schedule.next_alarm()                  # soonest alarm of any player
+    schedule.next_alarm('aa:bb:cc:dd:ee:ff')
+'''
+import datetime
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def occurrences(alarm, now, days=7):
+    '''upcoming times an LMS alarm will sound
+
+    Args:
+        alarm(dict): alarms_loop entry with "dow" (0=Sunday), "time" (seconds after midnight) and "repeat"
+        now(datetime.datetime): start of the period
+        days(int): length of the period
+
+    Returns:
+        (list): datetime.datetime objects in order'''
+    try:
+        dow = {int(d) for d in str(alarm.get('dow', '')).split(',') if d != ''}
+        seconds = int(float(alarm.get('time', 0)))
+    except ValueError:
+        logger.warning(f'invalid alarm {alarm}')
+        return []
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    times = []
+    for offset in range(days + 1):
+        day = midnight + datetime.timedelta(days=offset)
+        # python weekday: Monday=0; LMS dow: Sunday=0
+        if (day.weekday() + 1) % 7 not in dow:
+            continue
+        alarm_time = day + datetime.timedelta(seconds=seconds)
+        if alarm_time > now:
+            times.append(alarm_time)
+            if str(alarm.get('repeat', '1')) == '0':
+                break
+    return times
+
+
+class AlarmSchedule():
+    '''precomputed timeline of upcoming alarms for every player
+
+    Alarm data is fetched again when it is older than max_age seconds or when
+    an attached PlayerStateMirror reports an alarm change; the timeline is only
+    rebuilt when the fetched data differs.
+
+    Attributes:
+        lms(QueryLMS): QueryLMS object used to query the server
+        max_age(float): seconds before alarm data is fetched again
+        horizon(int): days of upcoming alarms to compute
+        workers(int): concurrent player queries
+        fetched(float): time.monotonic() of the last fetch
+    '''
+    def __init__(self, lms, max_age=300, horizon=7, workers=8):
+        '''inits AlarmSchedule
+
+        Args:
+            lms(QueryLMS): QueryLMS object used to query the server
+            max_age(float): seconds before alarm data is fetched again
+            horizon(int): days of upcoming alarms to compute
+            workers(int): concurrent player queries'''
+        self.lms = lms
+        self.max_age = max_age
+        self.horizon = horizon
+        self.workers = workers
+        self.fetched = None
+
+        self._alarms = {}
+        self._fingerprint = None
+        self._timeline = []
+        self._head = 0
+        self._next = {}
+        self._valid_until = None
+        self._stale = True
+        self._lock = threading.RLock()
+        if lms.mirror:
+            lms.mirror.add_event_listener(self._on_event)
+
+    def _on_event(self, player_id, command):
+        if command[:1] == ['alarm'] or (command[:1] == ['playerpref'] and
+                                        len(command) > 1 and command[1].startswith('alarm')):
+            self._stale = True
+
+    def _fetch_player(self, player_id):
+        try:
+            return player_id, self.lms.get_alarms(enabled=True, player_id=player_id).get('alarms_loop', [])
+        except Exception as e:
+            logger.warning(f'failed to fetch alarms for {player_id}: {e}')
+            return player_id, self._alarms.get(player_id, [])
+
+    def fetch(self):
+        '''fetch the alarms of all players concurrently
+
+        Returns:
+            (bool): True if the alarm data changed'''
+        # cleared first so an alarm event that arrives during the fetch is kept
+        self._stale = False
+        try:
+            player_ids = [p.get('playerid') for p in self.lms.get_players() if p.get('playerid')]
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(player_ids)))) as pool:
+                alarms = dict(pool.map(self._fetch_player, player_ids))
+        except Exception:
+            self._stale = True
+            raise
+        fingerprint = json.dumps(alarms, sort_keys=True)
+        with self._lock:
+            self.fetched = time.monotonic()
+            if fingerprint == self._fingerprint:
+                return False
+            self._fingerprint = fingerprint
+            self._alarms = alarms
+            self._build()
+        return True
+
+    def _build(self, now=None):
+        now = now or datetime.datetime.now()
+        timeline = []
+        for player_id, alarms in self._alarms.items():
+            for alarm in alarms:
+                for alarm_time in occurrences(alarm, now, self.horizon):
+                    timeline.append({'time': alarm_time, 'player_id': player_id,
+                                     'alarm_id': alarm.get('id'), 'volume': alarm.get('volume'),
+                                     'url': alarm.get('url'), 'repeat': alarm.get('repeat')})
+        timeline.sort(key=lambda a: a['time'])
+        self._timeline = timeline
+        self._head = 0
+        self._next = {}
+        for position, entry in enumerate(timeline):
+            self._next.setdefault(entry['player_id'], position)
+        # repeating alarms need new occurrences once the first day has passed
+        self._valid_until = now + datetime.timedelta(days=1)
+
+    def _current(self, now):
+        '''make sure the timeline is fresh and its head is in the future'''
+        if (self._stale or self.fetched is None or
+                time.monotonic() - self.fetched > self.max_age):
+            self.fetch()
+        with self._lock:
+            if self._valid_until is None or now >= self._valid_until:
+                self._build(now)
+            while self._head < len(self._timeline) and self._timeline[self._head]['time'] <= now:
+                self._head += 1
+
+    def _entry(self, entry, now):
+        entry = dict(entry)
+        entry['delta'] = (entry['time'] - now).total_seconds()
+        return entry
+
+    def next_alarm(self, player_id=None):
+        '''next alarm of any player, or of player_id
+
+        Args:
+            player_id(str): player id; None for the soonest alarm of any player
+
+        Returns:
+            (dict): {"time": datetime, "delta": seconds, "player_id", "alarm_id", "volume", "url", "repeat"} or {}'''
+        now = datetime.datetime.now()
+        self._current(now)
+        with self._lock:
+            if player_id is None:
+                if self._head < len(self._timeline):
+                    return self._entry(self._timeline[self._head], now)
+                return {}
+            position = self._next.get(player_id)
+            while position is not None and self._timeline[position]['time'] <= now:
+                position = next((i for i in range(position + 1, len(self._timeline))
+                                 if self._timeline[i]['player_id'] == player_id), None)
+                self._next[player_id] = position
+            if position is None:
+                self._next.pop(player_id, None)
+                return {}
+            return self._entry(self._timeline[position], now)
+
+    def timeline(self, limit=None):
+        '''upcoming alarms of all players in order
+
+        Args:
+            limit(int): maximum number of alarms
+
+        Returns:
+            (list): entries as returned by next_alarm()'''
+        now = datetime.datetime.now()
+        self._current(now)
+        with self._lock:
+            end = len(self._timeline) if limit is None else self._head + limit
+            return [self._entry(e, now) for e in self._timeline[self._head:end]]
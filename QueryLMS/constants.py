@@ -6,3 +6,10 @@ LMS_BRDCST_PORT = 3483
 LMS_BRDCST_TIMEOUT = 5
 LMS_QUERY_BASE_URL = 'http://{}:{}/'
 LMS_QUERY_ENDPOINT = '{}jsonrpc.js'
+LMS_PROXY_HOST = '127.0.0.1'
+LMS_PROXY_PORT = 9010
+LMS_PROXY_ENV = 'QUERYLMS_PROXY'
+LMS_STREAM_CHUNK_SIZE = 8192
+LMS_CLI_PORT = 9090
+LMS_GZIP_MIN_SIZE = 1024
+LMS_SYNC_GROUP_TTL = 5
@@ -0,0 +1,179 @@
+'''Incremental parsing of LMS JSON-RPC responses
+
+LMS returns lists such as artists, search hits and players as "<name>_loop"
+arrays inside the "result" object. iter_loop_items() scans the response body
+as it arrives and decodes one loop item at a time, so only the item being
+parsed and the current chunk are held in memory.
+'''
+import codecs
+import json
+import re
+
+_SPECIAL = re.compile(r'["{}\[\],:]')
+_STRING_END = re.compile(r'["\\]')
+_NON_SPACE = re.compile(r'\S')
+_decoder = json.JSONDecoder()
+
+
+class _Frame():
+    __slots__ = ('kind', 'role', 'key', 'expect_key')
+
+    def __init__(self, kind, role=None, key=None):
+        self.kind = kind
+        self.role = role
+        self.key = key
+        self.expect_key = kind == '{'
+
+
+class LoopParser():
+    '''push parser that emits "*_loop" items and other result values
+
+    feed() text in any sized pieces; each call returns the events completed so far:
+        ('item', '<name>_loop', item) for every loop item
+        ('field', key, value) for every other value of the result object
+    '''
+    def __init__(self):
+        self._buf = ''
+        self._pos = 0
+        self._stack = []
+        self._string_start = None
+        self._capture_start = None
+        self._capture_frame = None
+
+    def feed(self, text):
+        '''parse the next piece of the response body
+
+        Args:
+            text(str): next piece of the body
+
+        Returns:
+            (list): events completed by this piece'''
+        events = []
+        buf = self._buf = self._buf + text
+        pos = self._pos
+        stack = self._stack
+
+        while True:
+            if stack and stack[-1].role == 'loop':
+                # decode whole items at C speed; an item cut off by the end of
+                # the buffer raises ValueError and is retried with more data
+                m = _NON_SPACE.search(buf, pos)
+                if not m:
+                    pos = len(buf)
+                    break
+                c = m.group()
+                i = m.start()
+                if c == ',':
+                    pos = i + 1
+                    continue
+                if c == ']':
+                    stack.pop()
+                    pos = i + 1
+                    continue
+                try:
+                    item, end = _decoder.raw_decode(buf, i)
+                except ValueError:
+                    pos = i
+                    break
+                if c not in '{["' and (end >= len(buf) or buf[end] not in ' \t\r\n,]'):
+                    # a number may continue in the next piece
+                    pos = i
+                    break
+                events.append(('item', stack[-1].key, item))
+                pos = end
+                continue
+
+            if self._string_start is not None:
+                m = _STRING_END.search(buf, pos)
+                if not m:
+                    pos = len(buf)
+                    break
+                if m.group() == '\\':
+                    if m.end() >= len(buf):
+                        pos = m.start()
+                        break
+                    pos = m.end() + 1
+                    continue
+                top = stack[-1] if stack else None
+                if top and top.expect_key and top.role in ('root', 'result'):
+                    top.key = json.loads(buf[self._string_start:m.end()])
+                self._string_start = None
+                pos = m.end()
+                continue
+
+            m = _SPECIAL.search(buf, pos)
+            if not m:
+                pos = len(buf)
+                break
+            c = m.group()
+            i = m.start()
+            pos = m.end()
+
+            if c == '"':
+                self._string_start = i
+            elif c in '{[':
+                parent = stack[-1] if stack else None
+                frame = _Frame(c)
+                if parent is None:
+                    frame.role = 'root'
+                elif parent.role == 'root' and parent.key == 'result' and c == '{':
+                    frame.role = 'result'
+                elif parent.role == 'result' and c == '[' and str(parent.key).endswith('_loop'):
+                    frame.role = 'loop'
+                    frame.key = parent.key
+                    self._capture_start = None
+                stack.append(frame)
+            elif c == ':':
+                top = stack[-1]
+                top.expect_key = False
+                if top.role == 'result':
+                    self._capture_start = pos
+                    self._capture_frame = top
+            else:
+                top = stack[-1]
+                if self._capture_frame is top and self._capture_start is not None:
+                    text = buf[self._capture_start:i].strip()
+                    if text:
+                        events.append(('field', top.key, json.loads(text)))
+                    self._capture_start = None
+                if c == ',':
+                    top.expect_key = top.kind == '{'
+                else:
+                    stack.pop()
+
+        # drop everything that has been consumed
+        keep = min(p for p in (pos, self._string_start, self._capture_start) if p is not None)
+        self._buf = buf[keep:]
+        self._pos = pos - keep
+        if self._string_start is not None:
+            self._string_start -= keep
+        if self._capture_start is not None:
+            self._capture_start -= keep
+        return events
+
+
+def iter_loop_items(chunks, fields=None):
+    '''yield "*_loop" items from a JSON-RPC response body as it arrives
+
+    Args:
+        chunks(iterable): pieces of the response body (bytes or str)
+        fields(dict): if given, filled with the other values of the result
+            object such as "count"
+
+    Yields:
+        (tuple): ("<name>_loop", item)'''
+    parser = LoopParser()
+    for text in _decode(chunks):
+        for kind, key, value in parser.feed(text):
+            if kind == 'item':
+                yield key, value
+            elif fields is not None:
+                fields[key] = value
+
+
+def _decode(chunks):
+    '''decode utf-8 chunks that may split multi-byte characters'''
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in chunks:
+        yield decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+    yield decoder.decode(b'', final=True)
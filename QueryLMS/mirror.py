@@ -0,0 +1,299 @@
+'''Local mirror of the state of every player on an LMS
+
+A PlayerStateMirror keeps the power, mode, volume, current track, playlist
+position, sync group and connection state of all players in memory so that
+any number of readers can be answered without a round trip to the server.
+
+The mirror is kept current by a single background thread. When the LMS CLI
+(port 9090) is reachable it subscribes to player events with "listen 1" and
+refreshes only the players that report a change; otherwise, and as a periodic
+resync, it polls "serverstatus" and the "status" of each player.
+
+The CLI is not forwarded by querylms-proxy: when my_lms points at the proxy
+(e.g. through QUERYLMS_PROXY) pass the LMS host as cli_host.
+
+    mirror = PlayerStateMirror(my_lms).start()
+    my_lms.mirror = mirror      # QueryLMS getters now read from the mirror
+    mirror.get(my_lms.player_id, 'mixer volume')
+'''
+import logging
+import socket
+import threading
+import time
+from urllib.parse import unquote
+
+try:
+    from . import constants
+except ImportError as e:
+    import constants
+
+logger = logging.getLogger(__name__)
+
+# playlist_loop tags: artist, album, duration, coverid, album_id, genre, artwork_url, remote_title, remote
+MIRROR_STATUS_TAGS = 'tags:aldcegKNx'
+
+# serverstatus player keys kept in the mirror
+MIRROR_PLAYER_KEYS = ['name', 'ip', 'model', 'connected', 'power', 'isplaying']
+
+# CLI notifications that change the set of players or sync groups
+MIRROR_RESYNC_EVENTS = {'client', 'sync'}
+
+
+class PlayerStateMirror():
+    '''always-current local model of every player on the server
+
+    Attributes:
+        lms(QueryLMS): QueryLMS object used to query the server
+        interval(float): seconds between full resyncs
+        events(bool): subscribe to CLI player events for immediate updates
+        events_connected(bool): True while the CLI event subscription is active
+        cli_port(int): LMS CLI port
+        cli_host(str): LMS CLI host
+    '''
+    def __init__(self, lms, interval=5, events=True, cli_port=constants.LMS_CLI_PORT, cli_host=None):
+        '''inits PlayerStateMirror
+
+        Args:
+            lms(QueryLMS): QueryLMS object used to query the server
+            interval(float): seconds between full resyncs
+            events(bool): subscribe to CLI player events
+            cli_port(int): LMS CLI port
+            cli_host(str): LMS CLI host; default lms.host. Set it when lms.host is a proxy'''
+        self.lms = lms
+        self.interval = interval
+        self.events = events
+        self.cli_port = cli_port
+        self.cli_host = cli_host
+        self.events_connected = False
+
+        self._state = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._event_listeners = []
+        self._dirty = set()
+        self._resync = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def players(self):
+        '''player ids in the mirror: (list)'''
+        with self._lock:
+            return list(self._state)
+
+    def has(self, player_id):
+        '''True if player_id is mirrored
+
+        Args:
+            player_id(str): player id
+
+        Returns:
+            (bool)'''
+        with self._lock:
+            return player_id in self._state
+
+    def get(self, player_id, key=None, default=None):
+        '''read the mirrored state of a player
+
+        The playback "time" is advanced locally while the player is playing.
+
+        Args:
+            player_id(str): player id
+            key(str): status key e.g. "mode", "mixer volume", "track"; None for all
+            default: value returned if the player or key is unknown
+
+        Returns:
+            (dict) all state or the value of key'''
+        with self._lock:
+            state = self._state.get(player_id)
+            if state is None:
+                return default
+            if key is not None and key != 'time':
+                return state.get(key, default)
+            state = dict(state)
+
+        if state.get('mode') == 'play' and 'time' in state:
+            try:
+                elapsed = (time.monotonic() - state['updated']) * float(state.get('rate', 1) or 1)
+                state['time'] = float(state['time']) + elapsed
+            except (TypeError, ValueError):
+                pass
+        if key is not None:
+            return state.get(key, default)
+        return state
+
+    def add_listener(self, callback):
+        '''call callback(player_id, changes) whenever a player's state changes
+
+        changes is a dict of the changed keys and their new values; a removed
+        player is reported with changes=None
+
+        Args:
+            callback(callable)'''
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        '''stop calling a callback registered with add_listener
+
+        Args:
+            callback(callable)'''
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def add_event_listener(self, callback):
+        '''call callback(player_id, command) for every CLI notification
+
+        command is the list of words following the player id, e.g.
+        ['alarm', 'update', 'id:1a2b']; player_id is the first word of the
+        notification and may be a server level command such as "rescan"
+
+        Args:
+            callback(callable)'''
+        self._event_listeners.append(callback)
+
+    def _notify(self, player_id, changes):
+        for callback in list(self._listeners):
+            try:
+                callback(player_id, changes)
+            except Exception as e:
+                logger.warning(f'mirror listener {callback} failed: {e}')
+
+    def refresh_player(self, player_id, player=None):
+        '''query the status of a single player and apply the differences
+
+        Args:
+            player_id(str): player id
+            player(dict): serverstatus entry for the player, if already known
+
+        Returns:
+            (dict): changed keys and values'''
+        status = self.lms.query(player_id, 'status', '-', 1, MIRROR_STATUS_TAGS)
+        if not status:
+            return {}
+        update = {k: v for k, v in status.items() if k != 'playlist_loop'}
+        playlist = status.get('playlist_loop') or [{}]
+        update['track'] = playlist[0]
+        if player:
+            update.update({k: player[k] for k in MIRROR_PLAYER_KEYS if k in player})
+
+        with self._lock:
+            state = self._state.setdefault(player_id, {})
+            changes = {k: v for k, v in update.items() if state.get(k) != v and k != 'time'}
+            state.update(update)
+            state['updated'] = time.monotonic()
+        if changes:
+            self._notify(player_id, changes)
+        return changes
+
+    def sync(self, statuses=True):
+        '''bring the mirror up to date with the server
+
+        Args:
+            statuses(bool): also query the status of every player; when False only
+                players whose serverstatus entry changed are queried'''
+        players = {p.get('playerid'): p for p in self.lms.get_players() if p.get('playerid')}
+
+        with self._lock:
+            removed = [pid for pid in self._state if pid not in players]
+            for pid in removed:
+                del self._state[pid]
+        for pid in removed:
+            self._notify(pid, None)
+
+        for pid, player in players.items():
+            with self._lock:
+                state = self._state.get(pid)
+                stale = state is None or any(state.get(k) != player.get(k)
+                                             for k in MIRROR_PLAYER_KEYS if k in player)
+            if statuses or stale:
+                self.refresh_player(pid, player)
+
+    def start(self):
+        '''sync once and keep the mirror current in the background
+
+        Returns:
+            (PlayerStateMirror): self'''
+        self._stop.clear()
+        self.sync()
+        self._threads = [threading.Thread(target=self._run, name='lms-mirror', daemon=True)]
+        if self.events:
+            self._threads.append(threading.Thread(target=self._listen, name='lms-mirror-events',
+                                                  daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        '''stop updating the mirror'''
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=self.interval)
+        self._threads = []
+
+    def _run(self):
+        next_sync = time.monotonic() + self.interval
+        while not self._stop.is_set():
+            self._wake.wait(max(0, next_sync - time.monotonic()))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                resync, self._resync = self._resync, False
+            try:
+                if resync or time.monotonic() >= next_sync:
+                    # with events flowing, a periodic resync only needs to query
+                    # the status of players whose serverstatus entry changed
+                    self.sync(statuses=resync or not self.events_connected)
+                    next_sync = time.monotonic() + self.interval
+                for pid in dirty:
+                    self.refresh_player(pid)
+            except Exception as e:
+                logger.warning(f'failed to update player state mirror: {e}')
+
+    def _listen(self):
+        '''subscribe to CLI notifications and mark players that changed'''
+        while not self._stop.is_set():
+            try:
+                with socket.create_connection((self.cli_host or self.lms.host, self.cli_port),
+                                              timeout=self.interval) as sock:
+                    sock.sendall(b'listen 1\n')
+                    sock.settimeout(1)
+                    self.events_connected = True
+                    logger.debug(f'subscribed to LMS events on port {self.cli_port}')
+                    buffer = b''
+                    while not self._stop.is_set():
+                        try:
+                            data = sock.recv(4096)
+                        except socket.timeout:
+                            continue
+                        if not data:
+                            break
+                        buffer += data
+                        *lines, buffer = buffer.split(b'\n')
+                        for line in lines:
+                            self._event(line.decode('utf-8', 'replace'))
+            except OSError as e:
+                logger.debug(f'LMS event subscription on {self.cli_host or self.lms.host}:{self.cli_port} '
+                             f'unavailable, polling every {self.interval}s: {e}')
+            self.events_connected = False
+            self._stop.wait(self.interval)
+
+    def _event(self, line):
+        tokens = [unquote(t) for t in line.split()]
+        if len(tokens) < 2 or tokens[:2] == ['listen', '1']:
+            return
+        player_id, command = tokens[0], tokens[1]
+        for callback in list(self._event_listeners):
+            try:
+                callback(player_id, tokens[1:])
+            except Exception as e:
+                logger.warning(f'mirror event listener {callback} failed: {e}')
+        with self._lock:
+            if command in MIRROR_RESYNC_EVENTS or player_id not in self._state:
+                self._resync = True
+            else:
+                self._dirty.add(player_id)
+        self._wake.set()
@@ -0,0 +1,195 @@
+'''Prefetch metadata and artwork for upcoming tracks
+
+A Prefetcher reads the next few entries of a player's playlist and warms the
+songinfo and artwork caches of a QueryLMS object in the background, so that
+get_now_playing() and get_artwork() are answered locally as soon as the
+player moves on to the next track. Together with a PlayerStateMirror,
+get_now_playing(artwork=True) is then answered without any request.
+
+    my_lms.mirror = PlayerStateMirror(my_lms).start()
+    prefetcher = Prefetcher(my_lms, lookahead=3).start()
+'''
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TrackCache():
+    '''least recently used cache of songinfo and artwork
+
+    Only library tracks (positive track ids) are cached; remote streams report
+    changing metadata and are always queried.
+
+    Attributes:
+        size(int): maximum number of songinfo and of artwork entries
+    '''
+    def __init__(self, size=50):
+        '''inits TrackCache
+
+        Args:
+            size(int): maximum number of songinfo and of artwork entries'''
+        self.size = size
+        self._songinfo = OrderedDict()
+        self._artwork = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cacheable(track_id):
+        '''True if track_id is a library track
+
+        Args:
+            track_id: LMS track id
+
+        Returns:
+            (bool)'''
+        try:
+            return int(track_id) > 0
+        except (TypeError, ValueError):
+            return False
+
+    def _get(self, store, key):
+        with self._lock:
+            if key not in store:
+                return None
+            store.move_to_end(key)
+            return store[key]
+
+    def _put(self, store, key, value):
+        with self._lock:
+            store[key] = value
+            store.move_to_end(key)
+            while len(store) > self.size:
+                store.popitem(last=False)
+
+    def get_songinfo(self, track_id):
+        return self._get(self._songinfo, str(track_id))
+
+    def put_songinfo(self, track_id, info):
+        if self.cacheable(track_id):
+            self._put(self._songinfo, str(track_id), info)
+
+    def get_artwork(self, coverid):
+        return self._get(self._artwork, str(coverid))
+
+    def put_artwork(self, coverid, artwork):
+        self._put(self._artwork, str(coverid), artwork)
+
+    def clear(self):
+        '''empty the cache, e.g. after a library rescan'''
+        with self._lock:
+            self._songinfo.clear()
+            self._artwork.clear()
+
+
+class Prefetcher():
+    '''warm the track cache with the upcoming entries of players' playlists
+
+    The playlists are checked every interval seconds, or immediately when an
+    attached PlayerStateMirror reports a track change. With a mirror and a warm
+    cache, get_now_playing() sends no requests at all.
+
+    Attributes:
+        lms(QueryLMS): QueryLMS object whose cache is warmed
+        player_ids(list): players whose playlists are prefetched; None: lms.player_id
+        lookahead(int): number of upcoming tracks to prefetch
+        interval(float): seconds between playlist checks
+        artwork(bool): also prefetch cover art
+    '''
+    def __init__(self, lms, lookahead=3, interval=5, artwork=True, cache_size=50, player_ids=None):
+        '''inits Prefetcher
+
+        Enables lms.track_cache if it is not already set
+
+        Args:
+            lms(QueryLMS): QueryLMS object whose cache is warmed
+            lookahead(int): number of upcoming tracks to prefetch
+            interval(float): seconds between playlist checks
+            artwork(bool): also prefetch cover art
+            cache_size(int): size of the track cache created for lms
+            player_ids(list): players whose playlists are prefetched; default lms.player_id'''
+        self.lms = lms
+        self.player_ids = list(player_ids) if player_ids else None
+        self.lookahead = lookahead
+        self.interval = interval
+        self.artwork = artwork
+        if lms.track_cache is None:
+            players = len(self.player_ids) if self.player_ids else 1
+            lms.track_cache = TrackCache(max(cache_size, (lookahead + 1) * players))
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._mirror = None
+
+    def _players(self):
+        return self.player_ids or [self.lms.player_id]
+
+    def prefetch(self):
+        '''fetch songinfo and artwork for the current and next lookahead tracks
+
+        Returns:
+            (list): track ids that were fetched'''
+        fetched = []
+        for player_id in self._players():
+            fetched.extend(self._prefetch_player(player_id))
+        if fetched:
+            logger.debug(f'prefetched tracks {fetched}')
+        return fetched
+
+    def _prefetch_player(self, player_id):
+        status = self.lms.query(player_id, 'status', '-', self.lookahead + 1, 'tags:c')
+        fetched = []
+        for entry in status.get('playlist_loop', []):
+            track_id = entry.get('id')
+            if not TrackCache.cacheable(track_id):
+                continue
+            if self.lms.track_cache.get_songinfo(track_id) is None:
+                self.lms.get_song_info(track_id)
+                fetched.append(track_id)
+            coverid = entry.get('coverid')
+            if self.artwork and coverid and self.lms.track_cache.get_artwork(coverid) is None:
+                try:
+                    self.lms.get_artwork(coverid)
+                except Exception as e:
+                    logger.debug(f'failed to prefetch artwork {coverid}: {e}')
+        return fetched
+
+    def _on_change(self, player_id, changes):
+        if player_id in self._players() and changes and (
+                'playlist_cur_index' in changes or 'playlist_timestamp' in changes):
+            self._wake.set()
+
+    def start(self):
+        '''prefetch in a background thread until stop() is called
+
+        Returns:
+            (Prefetcher): self'''
+        self._mirror = self.lms.mirror
+        if self._mirror:
+            self._mirror.add_listener(self._on_change)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='lms-prefetch', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''stop prefetching'''
+        if self._mirror:
+            self._mirror.remove_listener(self._on_change)
+            self._mirror = None
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.prefetch()
+            except Exception as e:
+                logger.warning(f'failed to prefetch upcoming tracks: {e}')
+            self._wake.wait(self.interval)
+            self._wake.clear()
@@ -0,0 +1,342 @@
+'''Round trip profiling for QueryLMS
+
+A Profiler records a call tree of the public methods of a QueryLMS object and
+every request they send to the server, with the command, payload sizes and
+wall time. Trees can be exported as a Chrome trace (chrome://tracing,
+Perfetto) or as folded stacks for flamegraph.pl / speedscope.
+
+Round trip budgets turn the tree into a regression check, for example against
+a FakeTransport in a test:
+
+    lms = QueryLMS(host='fake', port=9000, player_id='aa:bb', transport=FakeTransport(responses))
+    with Profiler(lms) as profiler:
+        profiler.budget('get_now_playing', 2)
+        lms.get_now_playing()
+    profiler.check_budgets()    # raises BudgetExceeded
+'''
+import functools
+import inspect
+import json
+import threading
+import time
+
+
+class BudgetExceeded(AssertionError):
+    '''raised by Profiler.check_budgets() when a method sent too many requests'''
+
+
+class Call():
+    '''node of the profiler call tree
+
+    Attributes:
+        name(str): method name, or "request <command>" for server requests
+        start(float): perf_counter() at entry
+        end(float): perf_counter() at exit
+        thread(int): thread identifier
+        children(list): nested Call nodes
+        args(dict): request details: params, request_bytes, response_bytes
+    '''
+    __slots__ = ('name', 'start', 'end', 'thread', 'children', 'args')
+
+    def __init__(self, name, args=None):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.thread = threading.get_ident()
+        self.children = []
+        self.args = args or {}
+
+    @property
+    def is_request(self):
+        return self.name.startswith('request ')
+
+    @property
+    def duration(self):
+        '''wall time in seconds: (float)'''
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def requests(self):
+        '''number of server requests in this subtree: (int)'''
+        return int(self.is_request) + sum(c.requests for c in self.children)
+
+    def walk(self, stack=()):
+        '''yield (stack, node) for this node and all descendants'''
+        stack = stack + (self.name,)
+        yield stack, self
+        for child in self.children:
+            yield from child.walk(stack)
+
+
+def _size(body):
+    '''length of a request or response body in bytes'''
+    return len(body.encode('utf-8')) if isinstance(body, str) else len(body)
+
+
+class _TracingTransport():
+    '''pass requests to a transport and record them in the profiler call tree'''
+    def __init__(self, transport, profiler):
+        self.transport = transport
+        self._profiler = profiler
+
+    @property
+    def errors(self):
+        return self.transport.errors
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+    def post(self, url, payload, timeout=None):
+        params = payload.get('params', [None, []])
+        command = ' '.join(str(a) for a in params[1][:1])
+        call = self._profiler._enter(f'request {command}',
+                                     {'params': params, 'request_bytes': _size(json.dumps(payload))})
+        try:
+            response = self.transport.post(url, payload, timeout)
+            call.args['response_bytes'] = _size(response or '')
+            return response
+        finally:
+            self._profiler._exit(call)
+
+    def stream(self, url, payload, timeout=None, chunk_size=8192):
+        params = payload.get('params', [None, []])
+        command = ' '.join(str(a) for a in params[1][:1])
+        call = self._profiler._enter(f'request {command}',
+                                     {'params': params, 'request_bytes': _size(json.dumps(payload)),
+                                      'response_bytes': 0})
+        try:
+            for chunk in self.transport.stream(url, payload, timeout, chunk_size):
+                call.args['response_bytes'] += len(chunk)
+                yield chunk
+        finally:
+            self._profiler._exit(call)
+
+    def get(self, url, timeout=None):
+        call = self._profiler._enter('request GET', {'url': url, 'request_bytes': 0})
+        try:
+            content = self.transport.get(url, timeout)
+            call.args['response_bytes'] = len(content)
+            return content
+        finally:
+            self._profiler._exit(call)
+
+
+class Profiler():
+    '''record the call tree of public QueryLMS methods and the requests they send
+
+    Use as a context manager or call start() and stop(). Public methods and
+    read-only properties such as is_playing_remote_stream are recorded.
+
+    Attributes:
+        lms(QueryLMS): profiled QueryLMS object
+        calls(list): root Call nodes in the order they started
+        budgets(dict): {method name: maximum requests per call}
+    '''
+    def __init__(self, lms, budgets=None):
+        '''inits Profiler
+
+        Args:
+            lms(QueryLMS): QueryLMS object to profile
+            budgets(dict): {method name: maximum requests per call}'''
+        self.lms = lms
+        self.calls = []
+        self.budgets = dict(budgets or {})
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wrapped = []
+        self._class = None
+        self._transport = None
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _enter(self, name, args=None):
+        call = Call(name, args)
+        stack = self._stack()
+        if stack:
+            stack[-1].children.append(call)
+        else:
+            with self._lock:
+                self.calls.append(call)
+        stack.append(call)
+        return call
+
+    def _exit(self, call):
+        call.end = time.perf_counter()
+        stack = self._stack()
+        if stack and stack[-1] is call:
+            stack.pop()
+
+    def _wrap(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            call = self._enter(name)
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                self._exit(call)
+            if inspect.isgenerator(result):
+                # iterators send their requests while the caller consumes them
+                call.end = None
+                return self._wrap_generator(call, result)
+            return result
+        return wrapper
+
+    def _wrap_generator(self, call, generator):
+        '''re-enter call each time the generator is resumed'''
+        try:
+            while True:
+                stack = self._stack()
+                stack.append(call)
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    if stack and stack[-1] is call:
+                        stack.pop()
+                yield item
+        finally:
+            generator.close()
+            call.end = time.perf_counter()
+
+    def start(self):
+        '''start recording
+
+        Returns:
+            (Profiler): self'''
+        for name, member in inspect.getmembers(type(self.lms), inspect.isfunction):
+            if name.startswith('_') or name == 'query':
+                continue
+            setattr(self.lms, name, self._wrap(name, getattr(self.lms, name)))
+            self._wrapped.append(name)
+        # properties live on the class: trace them in a subclass used only by lms
+        cls = type(self.lms)
+        properties = {name: property(self._wrap(name, member.fget), doc=member.__doc__)
+                      for name, member in inspect.getmembers(cls, lambda m: isinstance(m, property))
+                      if not name.startswith('_') and member.fset is None}
+        if properties:
+            self._class = cls
+            self.lms.__class__ = type(cls.__name__, (cls,), properties)
+        self._transport = self.lms.transport
+        self.lms.transport = _TracingTransport(self._transport, self)
+        return self
+
+    def stop(self):
+        '''stop recording and restore the QueryLMS object'''
+        for name in self._wrapped:
+            delattr(self.lms, name)
+        self._wrapped = []
+        if self._class is not None:
+            self.lms.__class__ = self._class
+            self._class = None
+        if self._transport is not None:
+            self.lms.transport = self._transport
+            self._transport = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset(self):
+        '''discard recorded calls'''
+        with self._lock:
+            self.calls = []
+
+    def budget(self, method, max_requests):
+        '''declare the maximum number of server requests for one call of method
+
+        Args:
+            method(str): public QueryLMS method name e.g. "get_now_playing"
+            max_requests(int): allowed requests per call, including nested calls'''
+        self.budgets[method] = max_requests
+
+    def violations(self):
+        '''calls that sent more requests than their budget
+
+        Returns:
+            (list): (Call, budget) tuples'''
+        found = []
+        for root in self.calls:
+            for _, node in root.walk():
+                limit = self.budgets.get(node.name)
+                if limit is not None and node.requests > limit:
+                    found.append((node, limit))
+        return found
+
+    def check_budgets(self):
+        '''raise BudgetExceeded if any call sent more requests than its budget'''
+        violations = self.violations()
+        if violations:
+            lines = []
+            for node, limit in violations:
+                commands = [n.name[len('request '):] for _, n in node.walk() if n.is_request]
+                lines.append(f'{node.name}: {node.requests} requests (budget {limit}): {commands}')
+            raise BudgetExceeded('round trip budget exceeded\n' + '\n'.join(lines))
+
+    def summary(self):
+        '''requests and wall time per method
+
+        Returns:
+            (dict): {method: {"calls": int, "requests": int, "seconds": float, "bytes": int}}'''
+        summary = {}
+        for root in self.calls:
+            for _, node in root.walk():
+                if node.is_request:
+                    continue
+                entry = summary.setdefault(node.name, {'calls': 0, 'requests': 0,
+                                                       'seconds': 0.0, 'bytes': 0})
+                entry['calls'] += 1
+                entry['requests'] += node.requests
+                entry['seconds'] += node.duration
+                entry['bytes'] += sum(n.args.get('request_bytes', 0) + n.args.get('response_bytes', 0)
+                                      for _, n in node.walk() if n.is_request)
+        return summary
+
+    def chrome_trace(self, path=None):
+        '''export the call tree in Chrome trace event format
+
+        Args:
+            path(str): write the trace to this file if given
+
+        Returns:
+            (dict): {"traceEvents": [...]}'''
+        origin = min((c.start for c in self.calls), default=0)
+        events = []
+        for root in self.calls:
+            for _, node in root.walk():
+                events.append({'name': node.name,
+                               'cat': 'request' if node.is_request else 'method',
+                               'ph': 'X', 'pid': 1, 'tid': node.thread,
+                               'ts': round((node.start - origin) * 1e6, 3),
+                               'dur': round(node.duration * 1e6, 3),
+                               'args': node.args})
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if path:
+            with open(path, 'w') as f:
+                json.dump(trace, f)
+        return trace
+
+    def folded(self, path=None):
+        '''export the call tree as folded stacks weighted by microseconds of self time
+
+        Args:
+            path(str): write the stacks to this file if given
+
+        Returns:
+            (str): one "method;method;request 123" line per stack'''
+        weights = {}
+        for root in self.calls:
+            for stack, node in root.walk():
+                self_time = node.duration - sum(c.duration for c in node.children)
+                key = ';'.join(stack)
+                weights[key] = weights.get(key, 0) + max(0, int(self_time * 1e6))
+        folded = '\n'.join(f'{stack} {weight}' for stack, weight in weights.items()) + '\n'
+        if path:
+            with open(path, 'w') as f:
+                f.write(folded)
+        return folded
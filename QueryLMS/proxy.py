@@ -0,0 +1,305 @@
+'''Local caching proxy for LMS JSON-RPC queries
+
+Several processes on the same host can share one upstream connection pool by
+pointing QueryLMS at the proxy instead of the server:
+
+    $ querylms-proxy --host media-server.local --port 9000
+
+    my_player = QueryLMS(host='127.0.0.1', port=9010, player_name='My Player')
+
+or, without changing any code, by setting QUERYLMS_PROXY=127.0.0.1:9010 in the
+environment of scripts that rely on server discovery.
+
+Read-only queries (status, songinfo, serverstatus, "?" queries, ...) are cached
+for cache_ttl seconds and identical requests that arrive while one is already
+in flight upstream share its response. Any other command is forwarded directly
+and drops cached responses for the player it was sent to.
+
+JSON responses are gzip compressed for clients that accept it, so running the
+proxy on the LMS host (--listen 0.0.0.0) also shrinks payloads on the network.
+'''
+import argparse
+import gzip
+import json
+import logging
+import mimetypes
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from . import constants
+    from .QueryLMS import QueryLMS
+    from .transport import ReplayTransport, TRANSPORTS, get_transport
+except ImportError as e:
+    import constants
+    from QueryLMS import QueryLMS
+    from transport import ReplayTransport, TRANSPORTS, get_transport
+
+logger = logging.getLogger(__name__)
+
+# commands that never change server or player state
+READ_COMMANDS = {'status', 'songinfo', 'serverstatus', 'search', 'artists', 'albums',
+                 'titles', 'tracks', 'genres', 'years', 'players', 'alarms', 'info',
+                 'syncgroups', 'version'}
+
+
+def is_cacheable(args):
+    '''True if the LMS command args do not change state
+
+    Args:
+        args(list): LMS command e.g. ['mixer', 'volume', '?']
+
+    Returns:
+        (bool)'''
+    if not args:
+        return False
+    if args[-1] == '?' or args[0] in READ_COMMANDS:
+        return True
+    return args[0] == 'favorites' and len(args) > 1 and args[1] == 'items'
+
+
+class _Pending():
+    '''upstream request shared by coalesced callers'''
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class LMSProxy():
+    '''caching, coalescing JSON-RPC proxy for a single LMS server
+
+    Attributes:
+        upstream_url(str): LMS JSON-RPC url e.g. http://host:9000/jsonrpc.js
+        upstream_base_url(str): base url of the server for artwork and other GET requests
+        cache_ttl(float): seconds to cache responses to read-only queries
+        request_timeout(int): seconds to wait for the server to respond
+        stats(dict): counts of "requests", "upstream", "cache_hits" and "coalesced"
+        transport: transport used for upstream requests
+    '''
+    def __init__(self, host, port, cache_ttl=1.0, request_timeout=5, pool_size=4, transport=None):
+        '''inits LMSProxy
+
+        Args:
+            host(str): LMS host name or ip address
+            port(int): LMS port number
+            cache_ttl(float): seconds to cache read-only responses; 0 disables caching
+            request_timeout(int): seconds to wait for the server to respond
+            pool_size(int): upstream connections to keep open
+            transport: upstream transport object or name; default get_transport(pool_size=pool_size)'''
+        self.upstream_base_url = constants.LMS_QUERY_BASE_URL.format(host, port)
+        self.upstream_url = constants.LMS_QUERY_ENDPOINT.format(self.upstream_base_url)
+        self.cache_ttl = cache_ttl
+        self.request_timeout = request_timeout
+        self.stats = {'requests': 0, 'upstream': 0, 'cache_hits': 0, 'coalesced': 0}
+
+        if transport is None or isinstance(transport, str):
+            transport = get_transport(transport, pool_size=pool_size)
+        self.transport = transport
+        self._cache = {}
+        self._inflight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _upstream(self, player_id, args):
+        self.stats['upstream'] += 1
+        params = {'id': 1, 'method': 'slim.request', 'params': [player_id, args]}
+        r = self.transport.post(self.upstream_url, params, self.request_timeout)
+        if not r:
+            raise ConnectionError(f'no response from server for {args}')
+        return json.loads(r)
+
+    def _invalidate(self, player_id):
+        '''drop cached responses a command for player_id may have changed
+
+        Server level entries such as serverstatus include the power and mode of
+        every player, so they are dropped with the player's own entries. Reads
+        already in flight are not cached or joined by new requests.'''
+        with self._lock:
+            self._generation += 1
+            stale = [k for k in self._cache if not player_id or k[0] in (player_id, '')]
+            for key in stale:
+                del self._cache[key]
+            for key in [k for k in self._inflight if not player_id or k[0] in (player_id, '')]:
+                del self._inflight[key]
+
+    def forward(self, request):
+        '''answer a JSON-RPC request from cache or the upstream server
+
+        Args:
+            request(dict): JSON-RPC request {"id":, "method": "slim.request", "params": [player_id, args]}
+
+        Returns:
+            (dict): JSON-RPC response'''
+        self.stats['requests'] += 1
+        player_id, args = request.get('params', ['', []])
+        player_id = player_id or ''
+
+        if not (self.cache_ttl and is_cacheable(args)):
+            try:
+                return self._respond(request, self._upstream(player_id, args))
+            finally:
+                self._invalidate(player_id)
+
+        key = (player_id, json.dumps(args))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                self.stats['cache_hits'] += 1
+                return self._respond(request, cached[1])
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = _Pending()
+                self._inflight[key] = pending
+                generation = self._generation
+            else:
+                self.stats['coalesced'] += 1
+
+        if owner:
+            try:
+                pending.response = self._upstream(player_id, args)
+                with self._lock:
+                    # a command sent meanwhile may have made the response stale
+                    if generation == self._generation:
+                        self._cache[key] = (time.monotonic() + self.cache_ttl, pending.response)
+            except Exception as e:
+                pending.error = e
+            finally:
+                with self._lock:
+                    if self._inflight.get(key) is pending:
+                        del self._inflight[key]
+                pending.done.set()
+        else:
+            pending.done.wait(self.request_timeout)
+
+        if pending.error:
+            raise pending.error
+        if pending.response is None:
+            raise TimeoutError(f'timed out waiting for coalesced request {args}')
+        return self._respond(request, pending.response)
+
+    @staticmethod
+    def _respond(request, response):
+        '''copy of response carrying the id of the request'''
+        return {**response, 'id': request.get('id', response.get('id'))}
+
+    def fetch(self, path):
+        '''pass a GET request such as cover art through to the server
+
+        Args:
+            path(str): url path e.g. /music/c9d646ff/cover.jpg
+
+        Returns:
+            (bytes)'''
+        return self.transport.get(self.upstream_base_url + path.lstrip('/'),
+                                  self.request_timeout)
+
+    def make_server(self, listen_host=constants.LMS_PROXY_HOST, listen_port=constants.LMS_PROXY_PORT):
+        '''create a threaded HTTP server that answers requests with this proxy
+
+        Args:
+            listen_host(str): address to listen on
+            listen_port(int): port to listen on
+
+        Returns:
+            (ThreadingHTTPServer): call serve_forever() to start'''
+        server = ThreadingHTTPServer((listen_host, listen_port), _ProxyHandler)
+        server.daemon_threads = True
+        server.proxy = self
+        return server
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if (content_type == 'application/json' and len(body) >= constants.LMS_GZIP_MIN_SIZE
+                and 'gzip' in self.headers.get('Accept-Encoding', '')):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        # only a malformed client request is a 400; any failure after that is upstream
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            params = request.get('params', ['', []])
+            if not (isinstance(params, list) and len(params) == 2 and isinstance(params[1], list)):
+                raise ValueError('params must be [player_id, [command, ...]]')
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send(400, str(e).encode(), 'text/plain')
+            return
+        try:
+            response = self.server.proxy.forward(request)
+        except Exception as e:
+            logger.warning(f'upstream request failed: {e}')
+            self._send(502, str(e).encode(), 'text/plain')
+            return
+        self._send(200, json.dumps(response).encode())
+
+    def do_GET(self):
+        try:
+            content = self.server.proxy.fetch(self.path)
+        except Exception as e:
+            self._send(502, str(e).encode(), 'text/plain')
+            return
+        content_type = mimetypes.guess_type(self.path)[0] or 'application/octet-stream'
+        self._send(200, content, content_type)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def main(argv=None):
+    '''console entry point: querylms-proxy'''
+    parser = argparse.ArgumentParser(description='Local caching proxy for a Logitech Media Server')
+    parser.add_argument('--host', help='LMS host name or ip; searches the local network if not set')
+    parser.add_argument('--port', type=int, help='LMS port number')
+    parser.add_argument('--listen', default=constants.LMS_PROXY_HOST, help='address to listen on')
+    parser.add_argument('--listen-port', type=int, default=constants.LMS_PROXY_PORT,
+                        help='port to listen on')
+    parser.add_argument('--cache-ttl', type=float, default=1.0,
+                        help='seconds to cache read-only responses')
+    parser.add_argument('--timeout', type=int, default=5, help='seconds to wait for the server')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='answer from a RecordingTransport file instead of a server')
+    parser.add_argument('--transport', choices=list(TRANSPORTS),
+                        help='upstream HTTP client; default requests when installed')
+    parser.add_argument('-v', '--verbose', action='store_true', help='debug logging')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    host, port = args.host, args.port
+    transport = args.transport
+    if args.replay:
+        transport = ReplayTransport(args.replay)
+        host, port = host or 'replay', port or 0
+    elif not (host and port):
+        servers = QueryLMS.scan_lms()
+        if not servers:
+            parser.error('no LMS found on the local network; use --host and --port')
+        host = host or servers[0]['host']
+        port = port or servers[0]['port']
+
+    proxy = LMSProxy(host, port, cache_ttl=args.cache_ttl, request_timeout=args.timeout,
+                     transport=transport)
+    server = proxy.make_server(args.listen, args.listen_port)
+    logger.info(f'forwarding {args.listen}:{args.listen_port} to {proxy.upstream_base_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+import threading
+import unicodedata
+import logging
+
+logger = logging.getLogger(__name__)
+
+# category: (LMS command, response loop, name key, search id key, search name key)
+LIBRARY_CATEGORIES = {
+    'tracks': ('titles', 'titles_loop', 'title', 'track_id', 'track'),
+    'albums': ('albums', 'albums_loop', 'album', 'album_id', 'album'),
+    'contributors': ('artists', 'artists_loop', 'artist', 'contributor_id', 'contributor'),
+}
+
+SEARCH_MODES = ['substring', 'prefix', 'fuzzy']
+
+
+def normalize(text):
+    '''fold case and strip accents so "Beyoncé" matches "beyonce"
+
+    Args:
+        text(str): text to normalize
+
+    Returns:
+        (str)'''
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
+
+
+def trigrams(text):
+    '''set of three character substrings of text
+
+    Strings shorter than three characters are returned as a single gram
+
+    Args:
+        text(str): normalized text
+
+    Returns:
+        (set)'''
+    if len(text) < 3:
+        return {text} if text else set()
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+
+class _CategoryIndex():
+    '''trigram inverted index for a single library category'''
+    def __init__(self):
+        self.names = {}
+        self.normalized = {}
+        self.postings = {}
+
+    def add(self, item_id, name):
+        if item_id in self.names:
+            self.remove(item_id)
+        norm = normalize(name)
+        self.names[item_id] = name
+        self.normalized[item_id] = norm
+        for gram in trigrams(norm):
+            self.postings.setdefault(gram, set()).add(item_id)
+
+    def remove(self, item_id):
+        norm = self.normalized.pop(item_id, '')
+        self.names.pop(item_id, None)
+        for gram in trigrams(norm):
+            ids = self.postings.get(gram)
+            if ids:
+                ids.discard(item_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def candidates(self, term, any_gram=False):
+        '''ids that share trigrams with term
+
+        Args:
+            term(str): normalized search term
+            any_gram(bool): True: union of postings (fuzzy); False: intersection
+
+        Returns:
+            (set or None): None when the term is too short to use the index'''
+        grams = trigrams(term)
+        if len(term) < 3:
+            return None
+        postings = [self.postings.get(g, set()) for g in grams]
+        if any_gram:
+            return set().union(*postings)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            result &= ids
+            if not result:
+                break
+        return result
+
+
+def _rank(term, name, mode, min_similarity):
+    '''rank a normalized name against a normalized term; lower ranks sort first
+
+    Returns:
+        (tuple or None): None if name does not match'''
+    if name == term:
+        return (0, 0)
+    if name.startswith(term):
+        return (1, 0)
+    if mode == 'prefix':
+        if (' ' + term) in name:
+            return (2, 0)
+        return None
+    position = name.find(term)
+    if position > 0:
+        if name[position-1] == ' ':
+            return (2, 0)
+        return (3, position)
+    if mode == 'fuzzy':
+        term_grams = trigrams(term)
+        name_grams = trigrams(name)
+        if not term_grams or not name_grams:
+            return None
+        # share of the term's trigrams found in the name, damped by length difference
+        shared = len(term_grams & name_grams)
+        similarity = 2 * shared / (len(term_grams) + len(name_grams))
+        similarity = max(similarity, shared / len(term_grams) * 0.9)
+        if similarity >= min_similarity:
+            return (4, -similarity)
+    return None
+
+
+class SearchIndex():
+    '''local index of the LMS library for fast type-ahead searches
+
+    The index is built from a paged pull of the library ("titles", "albums" and
+    "artists") and answers prefix, substring and fuzzy searches locally. Results
+    use the same format as the server "search" command so the index can stand in
+    for QueryLMS.search_tracks(), search_albums() and search_contributors().
+
+    After a library rescan, run refresh() to pull the library again and apply
+    only the added, changed and removed items to the index.
+
+    Attributes:
+        lms(QueryLMS): QueryLMS object used for library queries
+        page_size(int): items to request per query when pulling the library
+        categories(list): library categories to index
+        min_similarity(float): 0-1 threshold for fuzzy matches
+        last_scan(str): "lastscan" value reported by the server at the last pull
+    '''
+    def __init__(self, lms, page_size=500, categories=None, min_similarity=0.4):
+        '''inits SearchIndex
+
+        Args:
+            lms(QueryLMS): QueryLMS object used for library queries
+            page_size(int): items to request per query
+            categories(list): any of "tracks", "albums", "contributors"; default all
+            min_similarity(float): 0-1 threshold for fuzzy matches'''
+        self.lms = lms
+        self.page_size = page_size
+        self.categories = categories or list(LIBRARY_CATEGORIES)
+        self.min_similarity = min_similarity
+        self.last_scan = None
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        '''True when the index has been built: (bool)'''
+        return bool(self._indexes)
+
+    def _pull(self, category):
+        '''page through a library category
+
+        Returns:
+            (dict): {item_id: name}'''
+        command, loop, name_key = LIBRARY_CATEGORIES[category][:3]
+        items = {}
+        start = 0
+        while True:
+            result = self.lms.query('', command, start, self.page_size)
+            page = result.get(loop, [])
+            for item in page:
+                items[item.get('id')] = item.get(name_key, '')
+            start += self.page_size
+            if not page or start >= int(result.get('count', 0)):
+                break
+        logger.debug(f'pulled {len(items)} {category} from server')
+        return items
+
+    def _server_last_scan(self):
+        return self.lms.get_server_status().get('lastscan')
+
+    def build(self):
+        '''pull the library from the server and build the index from scratch
+
+        Returns:
+            (SearchIndex): self'''
+        last_scan = self._server_last_scan()
+        indexes = {}
+        for category in self.categories:
+            index = _CategoryIndex()
+            for item_id, name in self._pull(category).items():
+                index.add(item_id, name)
+            indexes[category] = index
+        with self._lock:
+            self._indexes = indexes
+            self.last_scan = last_scan
+        return self
+
+    def refresh(self, force=False):
+        '''update the index after a library rescan
+
+        Nothing is pulled if the server "lastscan" is unchanged. Otherwise the
+        library is pulled again and only the differences are applied.
+
+        Args:
+            force(bool): pull the library even if lastscan is unchanged
+
+        Returns:
+            (bool): True if the index changed'''
+        if not self.ready:
+            self.build()
+            return True
+        last_scan = self._server_last_scan()
+        if not force and last_scan == self.last_scan:
+            return False
+
+        changed = False
+        for category in self.categories:
+            items = self._pull(category)
+            with self._lock:
+                index = self._indexes.setdefault(category, _CategoryIndex())
+                for item_id in set(index.names) - set(items):
+                    index.remove(item_id)
+                    changed = True
+                for item_id, name in items.items():
+                    if index.names.get(item_id) != name:
+                        index.add(item_id, name)
+                        changed = True
+        self.last_scan = last_scan
+        return changed
+
+    def search(self, category, searchstring, count=9999, mode='substring'):
+        '''search a library category
+
+        Matches are ranked: exact, prefix, word prefix, substring then fuzzy
+
+        Args:
+            category(str): "tracks", "albums" or "contributors"
+            searchstring(str): string to search for (ignoring case and accents)
+            count(int): maximum number of results to return
+            mode(str): "substring", "prefix" or "fuzzy"
+
+        Returns:
+            (dict): {"<category>_count": int, "<category>_loop": list} in the format
+            of the server "search" command'''
+        if mode not in SEARCH_MODES:
+            raise ValueError(f'invalid search mode "{mode}"; use one of {SEARCH_MODES}')
+        id_key, name_key = LIBRARY_CATEGORIES[category][3:]
+        term = normalize(searchstring)
+
+        matches = []
+        with self._lock:
+            index = self._indexes.get(category)
+            if index is None:
+                raise KeyError(f'category "{category}" is not indexed')
+            if not term:
+                candidates = set()
+            else:
+                candidates = index.candidates(term, any_gram=(mode == 'fuzzy'))
+            if candidates is None:
+                candidates = index.normalized.keys()
+            for item_id in candidates:
+                norm = index.normalized[item_id]
+                rank = _rank(term, norm, mode, self.min_similarity)
+                if rank is not None:
+                    matches.append((rank, len(norm), norm, item_id, index.names[item_id]))
+
+        matches.sort(key=lambda m: m[:3])
+        response = {f'{category}_count': len(matches)}
+        if matches:
+            response[f'{category}_loop'] = [{id_key: m[3], name_key: m[4]} for m in matches[:count]]
+        return response
@@ -0,0 +1,462 @@
+'''Transports carry JSON-RPC requests from QueryLMS to the server
+
+A transport provides:
+    post(url, payload, timeout): send a JSON-RPC payload (dict), return the response body (str)
+    stream(url, payload, timeout, chunk_size): as post, but yield the body in pieces (bytes)
+    get(url, timeout): fetch a url such as cover art, return the body (bytes)
+    errors: tuple of exceptions raised for connection problems
+
+QueryLMS uses RequestsTransport when the requests package is installed and
+the standard library HTTPClientTransport otherwise; pass a transport object or
+the name "requests" or "http.client" to choose. requests is only imported when
+a RequestsTransport sends its first request, so importing QueryLMS stays cheap
+on small devices. RecordingTransport and ReplayTransport capture real exchanges with a server
+and play them back later without one. FakeTransport answers from canned
+results, e.g. for tests.
+'''
+import base64
+import gzip
+import http.client
+import importlib.util
+import json
+import logging
+import select
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayMiss(LookupError):
+    '''raised when a replayed request was never recorded'''
+
+
+class RequestsTransport():
+    '''send requests with a pooled requests.Session
+
+    requests asks for gzip compressed responses and decodes them transparently,
+    so payloads are compressed whenever the server or proxy supports it.
+    requests is imported when the first request is sent'''
+    def __init__(self, pool_size=None):
+        '''inits RequestsTransport
+
+        Args:
+            pool_size(int): connections to keep open per host; default requests value'''
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def errors(self):
+        import requests
+        return (requests.exceptions.RequestException,)
+
+    @property
+    def session(self):
+        '''requests.Session, created on first use'''
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    session = requests.Session()
+                    if self.pool_size:
+                        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                                pool_maxsize=self.pool_size)
+                        session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def post(self, url, payload, timeout=None):
+        r = self.session.post(url, data=json.dumps(payload), timeout=timeout)
+        return r.text if r else ''
+
+    def stream(self, url, payload, timeout=None, chunk_size=8192):
+        r = self.session.post(url, data=json.dumps(payload), timeout=timeout, stream=True)
+        try:
+            if r:
+                yield from r.iter_content(chunk_size)
+        finally:
+            r.close()
+
+    def get(self, url, timeout=None):
+        r = self.session.get(url, timeout=timeout)
+        r.raise_for_status()
+        return r.content
+
+
+class HTTPClientTransport():
+    '''send requests with the standard library http.client
+
+    Needs no third party packages and imports only a fraction of the modules
+    requests does. Connections are kept alive and reused from a pool; idle
+    connections the server has closed are discarded before reuse. Responses
+    are requested gzip compressed and decoded with zlib.
+
+    Attributes:
+        pool_size(int): idle connections kept open per host
+    '''
+    errors = (OSError, http.client.HTTPException)
+
+    def __init__(self, pool_size=10):
+        '''inits HTTPClientTransport
+
+        Args:
+            pool_size(int): idle connections kept open per host'''
+        self.pool_size = pool_size or 10
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, url, timeout):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        connection = None
+        while connection is None:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                connection = idle.pop()
+            if self._dropped(connection):
+                connection.close()
+                connection = None
+        reused = connection is not None
+        if not reused:
+            connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                else http.client.HTTPConnection)
+            connection = connection_class(parts.hostname, parts.port)
+        connection.timeout = timeout
+        if connection.sock:
+            connection.sock.settimeout(timeout)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        return key, connection, path, reused
+
+    @staticmethod
+    def _dropped(connection):
+        '''True if the server closed an idle connection: it is readable (EOF) while no response is due'''
+        if connection.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _request(self, method, url, body, timeout):
+        '''send a request and return (key, connection, response) with the headers read'''
+        headers = {'Accept-Encoding': 'gzip'}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        key, connection, path, reused = self._connection(url, timeout)
+        try:
+            try:
+                connection.request(method, path, body=body, headers=headers)
+            except OSError:
+                # a reused connection the server closed just now fails while
+                # sending, before a request could be read: retry on a new one.
+                # Failures after sending are not retried, commands such as
+                # "mixer volume +5" must not run twice
+                connection.close()
+                if not reused:
+                    raise
+                logger.debug(f'connection to {key[1]}:{key[2]} was closed; reconnecting')
+                key, connection, path, reused = self._connection(url, timeout)
+                connection.request(method, path, body=body, headers=headers)
+            return key, connection, connection.getresponse()
+        except BaseException:
+            connection.close()
+            raise
+
+    def _finish(self, key, connection, response):
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+
+    def _read(self, method, url, body, timeout):
+        key, connection, response = self._request(method, url, body, timeout)
+        try:
+            content = response.read()
+        except BaseException:
+            connection.close()
+            raise
+        self._finish(key, connection, response)
+        if response.getheader('Content-Encoding', '').lower() == 'gzip':
+            content = gzip.decompress(content)
+        return response, content
+
+    def post(self, url, payload, timeout=None):
+        response, content = self._read('POST', url, json.dumps(payload).encode('utf-8'), timeout)
+        return content.decode('utf-8') if response.status < 400 else ''
+
+    def stream(self, url, payload, timeout=None, chunk_size=8192):
+        key, connection, response = self._request('POST', url, json.dumps(payload).encode('utf-8'), timeout)
+        try:
+            if response.status >= 400:
+                response.read()
+                self._finish(key, connection, response)
+                return
+            decoder = None
+            if response.getheader('Content-Encoding', '').lower() == 'gzip':
+                decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                if decoder:
+                    chunk = decoder.decompress(chunk)
+                if chunk:
+                    yield chunk
+            if decoder:
+                tail = decoder.flush()
+                if tail:
+                    yield tail
+        except BaseException:
+            # includes GeneratorExit: an unfinished response cannot be reused
+            connection.close()
+            raise
+        self._finish(key, connection, response)
+
+    def get(self, url, timeout=None):
+        response, content = self._read('GET', url, None, timeout)
+        if response.status >= 400:
+            raise http.client.HTTPException(f'{response.status} {response.reason} for url: {url}')
+        return content
+
+    def close(self):
+        '''close all idle connections'''
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+TRANSPORTS = {'requests': RequestsTransport, 'http.client': HTTPClientTransport}
+
+
+def get_transport(name=None, pool_size=None):
+    '''create a transport by name
+
+    Args:
+        name(str): "requests", "http.client" or None to use requests when it is installed
+        pool_size(int): connections to keep open per host
+
+    Returns:
+        RequestsTransport or HTTPClientTransport'''
+    if name is None or name == 'auto':
+        name = 'requests' if importlib.util.find_spec('requests') else 'http.client'
+    try:
+        transport_class = TRANSPORTS[name]
+    except KeyError:
+        raise ValueError(f'unknown transport {name!r}; choose from {", ".join(TRANSPORTS)}')
+    return transport_class(pool_size=pool_size)
+
+
+def _open(path, mode):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class RecordingTransport():
+    '''record every exchange passing through another transport
+
+    Each exchange is written as one JSON line (gzip compressed if path ends in .gz):
+        {"params": [player_id, args], "start": s, "elapsed": s, "response": str}
+    Streams that were not read to the end are marked "truncated": true.
+    GET requests are stored with "url" in place of "params" and a base64 body.
+
+    Attributes:
+        path(str): recording file
+        transport: transport the requests are passed to
+    '''
+    def __init__(self, path, transport=None):
+        '''inits RecordingTransport
+
+        Args:
+            path(str): file to write; .gz suffix compresses the recording
+            transport: transport to record; default get_transport()'''
+        self.path = path
+        self.transport = transport or get_transport()
+        self._file = _open(path, 'w')
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+
+    @property
+    def errors(self):
+        return self.transport.errors
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+
+    def post(self, url, payload, timeout=None):
+        start = time.monotonic()
+        response = self.transport.post(url, payload, timeout)
+        end = time.monotonic()
+        self._write({'params': payload.get('params'), 'start': round(start - self._t0, 6),
+                     'elapsed': round(end - start, 6), 'response': response})
+        return response
+
+    def stream(self, url, payload, timeout=None, chunk_size=8192):
+        start = time.monotonic()
+        chunks = []
+        complete = False
+        try:
+            for chunk in self.transport.stream(url, payload, timeout, chunk_size):
+                chunks.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            # streams abandoned early or cut off by an error are recorded as far as
+            # they were received, so replaying the same requests still finds them
+            end = time.monotonic()
+            record = {'params': payload.get('params'), 'start': round(start - self._t0, 6),
+                      'elapsed': round(end - start, 6),
+                      'response': b''.join(chunks).decode('utf-8', 'replace')}
+            if not complete:
+                record['truncated'] = True
+            self._write(record)
+
+    def get(self, url, timeout=None):
+        start = time.monotonic()
+        content = self.transport.get(url, timeout)
+        end = time.monotonic()
+        self._write({'url': url, 'start': round(start - self._t0, 6),
+                     'elapsed': round(end - start, 6),
+                     'response': base64.b64encode(content).decode('ascii')})
+        return content
+
+    def close(self):
+        '''finish writing the recording'''
+        with self._lock:
+            self._file.close()
+
+
+class ReplayTransport():
+    '''answer requests from a recording made with RecordingTransport
+
+    Requests are matched on player_id and command. Repeated identical requests
+    are answered with the recorded responses in order; once those run out the
+    last one is repeated.
+
+    Attributes:
+        latency(float): 0: answer immediately; 1: original latency; other values scale it
+    '''
+    errors = ()
+
+    def __init__(self, path, latency=False):
+        '''inits ReplayTransport
+
+        Args:
+            path(str): recording file
+            latency(bool or float): False: no delay; True: original delay; float: delay multiplier'''
+        self.latency = float(latency)
+        self._records = {}
+        self._lock = threading.Lock()
+        with _open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._records.setdefault(self._key(record), []).append(record)
+        self._position = {key: 0 for key in self._records}
+
+    @staticmethod
+    def _key(record):
+        if 'url' in record:
+            return 'GET ' + record['url'].split('/', 3)[-1]
+        player_id, args = record['params']
+        return json.dumps([player_id or '', [str(a) for a in args]])
+
+    def _replay(self, key, request):
+        with self._lock:
+            records = self._records.get(key)
+            if not records:
+                raise ReplayMiss(f'no recorded response for {request}')
+            position = self._position[key]
+            self._position[key] = min(position + 1, len(records) - 1)
+        record = records[position]
+        if self.latency:
+            time.sleep(record.get('elapsed', 0) * self.latency)
+        return record['response']
+
+    def post(self, url, payload, timeout=None):
+        return self._replay(self._key(payload), payload.get('params'))
+
+    def stream(self, url, payload, timeout=None, chunk_size=8192):
+        body = self.post(url, payload, timeout).encode('utf-8')
+        for i in range(0, len(body), chunk_size):
+            yield body[i:i+chunk_size]
+
+    def get(self, url, timeout=None):
+        return base64.b64decode(self._replay(self._key({'url': url}), url))
+
+    def rewind(self):
+        '''start replaying each request from its first recorded response'''
+        with self._lock:
+            self._position = {key: 0 for key in self._records}
+
+
+class FakeTransport():
+    '''answer requests from canned results without a server
+
+    responses maps a command to its result: keys are matched against the
+    longest leading part of the command, so ('mixer', 'volume') answers
+    ['mixer', 'volume', '?'] and 'status' answers ['status', '-']. A value may
+    be a callable taking (player_id, args) and returning the result.
+    Unmatched commands return an empty result.
+
+    Attributes:
+        responses(dict): {command or tuple of command words: result}
+        requests(list): [player_id, args] of every request received
+    '''
+    errors = ()
+
+    def __init__(self, responses=None, artwork=b''):
+        '''inits FakeTransport
+
+        Args:
+            responses(dict): {command or tuple of command words: result dict or callable}
+            artwork(bytes): body returned for every GET request'''
+        self.responses = dict(responses or {})
+        self.artwork = artwork
+        self.requests = []
+
+    def _result(self, player_id, args):
+        words = [str(a) for a in args]
+        for length in range(len(words), 0, -1):
+            key = tuple(words[:length])
+            for candidate in (key, key[0] if length == 1 else None):
+                if candidate in self.responses:
+                    result = self.responses[candidate]
+                    return result(player_id, args) if callable(result) else result
+        return {}
+
+    def post(self, url, payload, timeout=None):
+        player_id, args = payload.get('params', [None, []])
+        self.requests.append([player_id, args])
+        return json.dumps({'id': payload.get('id'), 'method': 'slim.request',
+                           'params': payload.get('params'),
+                           'result': self._result(player_id, args)})
+
+    def stream(self, url, payload, timeout=None, chunk_size=8192):
+        body = self.post(url, payload, timeout).encode('utf-8')
+        for i in range(0, len(body), chunk_size):
+            yield body[i:i+chunk_size]
+
+    def get(self, url, timeout=None):
+        self.requests.append(['GET', url])
+        return self.artwork
@@ -23,7 +23,9 @@ setuptools.setup(
         "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)",
         "Operating System :: OS Independent"],
     keywords="graphics e-paper display waveshare",
-    install_requires=["requests"],
+    install_requires=[],
+    extras_require={"requests": ["requests"]},
+    entry_points={"console_scripts": ["querylms-proxy=QueryLMS.proxy:main"]},
     project_urls={"Source": "https://github.com/txoof/querylms"},
     python_requires=">=3.7",
     package_data={"documentation": ["./docs"]},
@@ -0,0 +1,53 @@
+'''AlarmSchedule against FakeTransport with several players'''
+import datetime
+
+from QueryLMS import QueryLMS
+from QueryLMS.alarms import AlarmSchedule
+from QueryLMS.transport import FakeTransport
+
+EVERY_DAY = '0,1,2,3,4,5,6'
+
+# player id: (alarm id, seconds after midnight)
+ALARMS = {
+    'aa:aa:aa:aa:aa:01': ('kitchen', 6 * 3600),
+    'aa:aa:aa:aa:aa:02': ('bedroom', 7 * 3600 + 1800),
+    'aa:aa:aa:aa:aa:03': ('office', 8 * 3600),
+}
+
+
+def alarms(player_id, args):
+    alarm_id, seconds = ALARMS[player_id]
+    return {'count': 1, 'alarms_loop': [{'id': alarm_id, 'dow': EVERY_DAY, 'time': str(seconds),
+                                         'repeat': '1', 'enabled': '1'}]}
+
+
+def make_schedule():
+    transport = FakeTransport({
+        'serverstatus': {'players_loop': [{'playerid': pid} for pid in ALARMS]},
+        ('playerpref', 'alarmsEnabled'): {'_p2': '1'},
+        'alarms': alarms,
+    })
+    # no associated player: every query names its player
+    return AlarmSchedule(QueryLMS(host='fake', port=9000, transport=transport)), transport
+
+
+def test_next_alarm_per_player():
+    schedule, transport = make_schedule()
+    for pid, (alarm_id, seconds) in ALARMS.items():
+        alarm = schedule.next_alarm(pid)
+        assert alarm['player_id'] == pid
+        assert alarm['alarm_id'] == alarm_id
+        assert alarm['time'].hour * 3600 + alarm['time'].minute * 60 == seconds
+        assert 0 < alarm['delta'] <= 86400
+    alarm_requests = [pid for pid, args in transport.requests if args[0] in ('alarms', 'playerpref')]
+    assert sorted(alarm_requests) == sorted(list(ALARMS) * 2)
+
+
+def test_next_alarm_of_any_player():
+    schedule, _ = make_schedule()
+    now = datetime.datetime.now()
+    expected = min(ALARMS.values(), key=lambda a: (datetime.datetime.combine(now.date(), datetime.time())
+                                                   + datetime.timedelta(seconds=a[1]) - now)
+                   % datetime.timedelta(days=1))
+    assert schedule.next_alarm()['alarm_id'] == expected[0]
+    assert [a['alarm_id'] for a in schedule.timeline(3)].count(expected[0]) == 1
@@ -0,0 +1,85 @@
+'''requests for other players are sent to those players, checked against FakeTransport'''
+import pytest
+
+from QueryLMS import QueryLMS
+from QueryLMS.mirror import PlayerStateMirror
+from QueryLMS.prefetch import Prefetcher
+from QueryLMS.transport import FakeTransport
+
+PLAYERS = ['aa:aa:aa:aa:aa:01', 'aa:aa:aa:aa:aa:02']
+
+
+def status(player_id, args):
+    return {'player_name': f'player {player_id}', 'mode': 'play',
+            'playlist_loop': [{'id': 1, 'title': 'Song'}]}
+
+
+@pytest.fixture
+def transport():
+    return FakeTransport({
+        'serverstatus': {'players_loop': [{'playerid': pid, 'name': f'player {pid}'} for pid in PLAYERS]},
+        'status': status,
+    })
+
+
+@pytest.fixture
+def lms(transport):
+    # a shared mirror or dashboard has no associated player
+    return QueryLMS(host='fake', port=9000, transport=transport)
+
+
+def test_query_honours_player_id(lms, transport):
+    lms.query(PLAYERS[1], 'mode', '?')
+    lms.query('', 'serverstatus', 0, 99)
+    assert [player_id for player_id, _ in transport.requests] == [PLAYERS[1], '']
+
+
+def test_query_defaults_to_associated_player(transport):
+    lms = QueryLMS(host='fake', port=9000, player_id=PLAYERS[0], transport=transport)
+    lms.query(None, 'mode', '?')
+    list(lms.query_stream(None, 'status', '-'))
+    assert [player_id for player_id, _ in transport.requests] == [PLAYERS[0]] * 2
+
+
+def test_mirror_queries_each_player(lms, transport):
+    mirror = PlayerStateMirror(lms, events=False)
+    mirror.sync()
+    status_requests = [player_id for player_id, args in transport.requests if args[0] == 'status']
+    assert status_requests == PLAYERS
+    for pid in PLAYERS:
+        assert mirror.get(pid, 'player_name') == f'player {pid}'
+
+
+def test_query_group_commands_each_player(lms, transport):
+    lms.query_group('mixer', 'volume', 5, player_ids=PLAYERS)
+    assert transport.requests == [[pid, ['mixer', 'volume', 5]] for pid in PLAYERS]
+
+
+def test_query_group_sends_playback_once_per_group(lms, transport):
+    transport.responses['syncgroups'] = {'syncgroups_loop': [{'sync_members': ','.join(PLAYERS)}]}
+    lms.query_group('pause', 1, player_ids=PLAYERS)
+    assert [r for r in transport.requests if r[1][0] == 'pause'] == [[PLAYERS[0], ['pause', 1]]]
+
+
+def test_now_playing_group_queries_masters(lms, transport):
+    group = lms.get_now_playing_group(fields=['title', 'player_name'])
+    status_requests = sorted(pid for pid, args in transport.requests if args[0] == 'status')
+    assert status_requests == PLAYERS
+    for pid in PLAYERS:
+        assert group[pid]['player_name'] == f'player {pid}'
+
+
+def test_prefetch_queries_each_player(lms, transport):
+    transport.responses['songinfo'] = {'songinfo_loop': [{'id': 1}, {'title': 'Song'}]}
+    Prefetcher(lms, player_ids=PLAYERS, artwork=False).prefetch()
+    status_requests = [pid for pid, args in transport.requests if args[0] == 'status']
+    assert status_requests == PLAYERS
+
+
+def test_prefetcher_restart_keeps_one_listener(lms):
+    lms.mirror = PlayerStateMirror(lms, events=False)
+    prefetcher = Prefetcher(lms, interval=60)
+    for _ in range(3):
+        prefetcher.start()
+        prefetcher.stop()
+    assert lms.mirror._listeners == []
@@ -0,0 +1,72 @@
+'''round trip budgets of QueryLMS methods, checked against FakeTransport'''
+import json
+
+import pytest
+
+from QueryLMS import QueryLMS
+from QueryLMS.profiler import BudgetExceeded, Profiler
+from QueryLMS.transport import FakeTransport
+
+PLAYER_ID = 'aa:bb:cc:dd:ee:ff'
+
+RESPONSES = {
+    'serverstatus': {'players_loop': [{'playerid': PLAYER_ID, 'name': 'Living Room'}]},
+    'status': {'mode': 'play', 'time': 12.5, 'player_name': 'Living Room', 'mixer volume': 30,
+               'playlist_cur_index': '0',
+               'playlist_loop': [{'id': 5, 'title': 'Song', 'artist': 'Band'}]},
+    'songinfo': {'songinfo_loop': [{'id': 5}, {'title': 'Song'}, {'artist': 'Band'},
+                                   {'album': 'Record'}, {'genre': 'Rock'}, {'duration': 200},
+                                   {'coverid': 'c0ffee'}]},
+    ('remote', '?'): {'_remote': 0},
+}
+
+
+@pytest.fixture
+def lms():
+    return QueryLMS(host='fake', port=9000, player_id=PLAYER_ID, transport=FakeTransport(RESPONSES))
+
+
+def test_get_now_playing_budget(lms):
+    # status, songinfo and the _add_keys fallbacks for "remote" and "current_title"
+    with Profiler(lms) as profiler:
+        profiler.budget('get_now_playing', 4)
+        lms.get_now_playing()
+    profiler.check_budgets()
+    assert profiler.summary()['get_now_playing']['requests'] == 4
+
+
+def test_get_now_playing_fields_budget(lms):
+    with Profiler(lms, budgets={'get_now_playing': 1}) as profiler:
+        lms.get_now_playing(fields=['title', 'artist', 'mode'])
+    profiler.check_budgets()
+
+
+def test_budget_exceeded(lms):
+    with Profiler(lms, budgets={'get_now_playing': 2}) as profiler:
+        lms.get_now_playing()
+    with pytest.raises(BudgetExceeded, match='get_now_playing: 4 requests'):
+        profiler.check_budgets()
+
+
+def test_property_requests_are_charged_to_the_property(lms):
+    with Profiler(lms) as profiler:
+        lms.is_playing_remote_stream
+    assert [call.name for call in profiler.calls] == ['is_playing_remote_stream']
+    assert profiler.calls[0].requests == 1
+    assert type(lms) is QueryLMS
+
+
+def test_payload_sizes_are_bytes():
+    class Utf8Transport(FakeTransport):
+        # LMS sends UTF-8 rather than ASCII escapes
+        def post(self, url, payload, timeout=None):
+            return json.dumps(json.loads(super().post(url, payload, timeout)), ensure_ascii=False)
+
+    lms = QueryLMS(host='fake', port=9000, player_id=PLAYER_ID,
+                   transport=Utf8Transport({'current_title': {'_current_title': 'Für Elise'}}))
+    with Profiler(lms) as profiler:
+        lms.query(PLAYER_ID, 'current_title', '?')
+    request = profiler.calls[0]
+    body = lms.transport.post('', {'id': 1, 'method': 'slim.request',
+                                   'params': [PLAYER_ID, ['current_title', '?']]})
+    assert request.args['response_bytes'] == len(body.encode('utf-8')) == len(body) + 1
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+'''Benchmark QueryLMS against recorded LMS traffic
+
+Record real exchanges with a server:
+    $ python3 utilities/benchmark.py --record lms.jsonl.gz --host media-server.local --port 9000 \
+        --player-name "Living Room" --search love
+
+Replay them on a machine without an LMS, with or without the original latency:
+    $ python3 utilities/benchmark.py --replay lms.jsonl.gz --search love --repeat 100
+    $ python3 utilities/benchmark.py --replay lms.jsonl.gz --search love --latency 1
+
+Compare the import time and resident memory of the transports, each measured in
+a fresh interpreter:
+    $ python3 utilities/benchmark.py --imports --repeat 10
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from QueryLMS import QueryLMS, constants
+from QueryLMS.transport import RecordingTransport, ReplayTransport, TRANSPORTS, get_transport
+
+# run in a fresh interpreter: import QueryLMS, create a transport and load its
+# HTTP client (RequestsTransport imports requests on first use)
+IMPORT_PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+if {name!r}:
+    from QueryLMS import QueryLMS
+    from QueryLMS.transport import get_transport
+    get_transport({name!r}).errors
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{'seconds': elapsed, 'rss_kb': rss // 1024 if sys.platform == 'darwin' else rss}}))
+'''
+
+
+def timed(label, func, repeat):
+    '''run func repeat times and print timing statistics in milliseconds'''
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    print(f'{label:<28} n={repeat:<5} mean={statistics.mean(samples):8.3f}ms '
+          f'min={min(samples):8.3f}ms max={max(samples):8.3f}ms')
+
+
+def import_cost(name, repeat):
+    '''print import time and peak RSS of QueryLMS with transport name; '' for bare python'''
+    samples = []
+    rss = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', IMPORT_PROBE.format(root=ROOT, name=name)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+        samples.append(result['seconds'] * 1000)
+        rss.append(result['rss_kb'])
+    label = f'import {name}' if name else 'python (baseline)'
+    print(f'{label:<28} n={repeat:<5} mean={statistics.mean(samples):8.3f}ms '
+          f'min={min(samples):8.3f}ms rss={statistics.median(rss) / 1024:6.1f}MiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--record', metavar='FILE', help='record exchanges with a live server')
+    mode.add_argument('--replay', metavar='FILE', help='replay a recording')
+    mode.add_argument('--imports', action='store_true',
+                      help='compare import time and memory of the transports')
+    parser.add_argument('--transport', choices=list(TRANSPORTS),
+                        help='HTTP client when recording; default requests when installed')
+    parser.add_argument('--host', help='LMS host when recording')
+    parser.add_argument('--port', type=int, help='LMS port when recording')
+    parser.add_argument('--player-name', help='player to query when recording')
+    parser.add_argument('--player-id', help='player to query')
+    parser.add_argument('--search', action='append', default=[], help='search term; may be repeated')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='replay latency multiplier: 0 none, 1 original')
+    parser.add_argument('--repeat', type=int, default=20, help='iterations per benchmark')
+    args = parser.parse_args()
+
+    if args.imports:
+        for name in ['', *TRANSPORTS]:
+            try:
+                import_cost(name, args.repeat)
+            except subprocess.CalledProcessError as e:
+                print(f'import {name:<21} failed: {e.stderr.strip().splitlines()[-1]}')
+        return
+
+    if args.record:
+        transport = RecordingTransport(args.record, transport=get_transport(args.transport))
+        lms = QueryLMS(host=args.host, port=args.port, player_name=args.player_name,
+                       player_id=args.player_id, transport=transport)
+        repeat = 1
+        print(f'recording player_id {lms.player_id} to {args.record}')
+    else:
+        transport = ReplayTransport(args.replay, latency=args.latency)
+        lms = QueryLMS(host='replay', port=constants.LMS_PORT, player_id=args.player_id, transport=transport)
+        if not lms.player_id:
+            players = lms.get_players()
+            lms.player_id = players[0]['playerid'] if players else None
+        repeat = args.repeat
+
+    timed('get_now_playing', lms.get_now_playing, repeat)
+    for term in args.search:
+        timed(f'search_tracks({term!r})', lambda: lms.search_tracks(term), repeat)
+        timed(f'search_albums({term!r})', lambda: lms.search_albums(term), repeat)
+        timed(f'search_contributors({term!r})', lambda: lms.search_contributors(term), repeat)
+
+    if args.record:
+        lms.get_players()
+        transport.close()
+
+
+if __name__ == '__main__':
+    main()